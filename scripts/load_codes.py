@@ -13,7 +13,10 @@ from src.bot.db import Database
 async def main(csv_path: str, db_path: str = "./house-bots.db"):
     db = Database(db_path)
     await db.init()
-    await db.load_codes_from_csv(csv_path)
+    try:
+        await db.load_codes_from_csv(csv_path)
+    finally:
+        await db.close()
     print("Loaded codes from", csv_path)
 
 if __name__ == "__main__":
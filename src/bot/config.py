@@ -0,0 +1,67 @@
+from __future__ import annotations
+import logging
+import os
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger("house-bots")
+
+
+def _parse_admin_ids(raw: str) -> tuple[int, ...]:
+    if not raw:
+        return ()
+    try:
+        ids = tuple(int(admin_id.strip()) for admin_id in raw.split(",") if admin_id.strip())
+    except ValueError as e:
+        logger.error(f"Invalid ADMIN_IDS format: {raw}. Error: {e}")
+        return ()
+    logger.info(f"Loaded {len(ids)} admin IDs: {list(ids)}")
+    return ids
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Settings read from the environment (and .env) once at startup, in main()."""
+    bot_token: str
+    admin_ids: frozenset[int]  # a set makes is_admin a single hash lookup
+    admin_chat_id: int  # first configured admin, kept for the legacy ADMIN_CHAT_ID; 0 if none
+    house_id: str
+    auth_mode: str  # code | phone
+    access_days: int
+    db_path: str
+    concierge_min_interval_seconds: int
+    concierge_window_seconds: int
+    concierge_max_messages_per_window: int
+    max_media_size_mb: int
+    state_ttl_minutes: int  # idle FSM state is dropped after this
+    redis_url: str  # optional; FSM state goes to Redis instead of process memory
+
+    @property
+    def max_media_bytes(self) -> int:
+        return self.max_media_size_mb * 1024 * 1024
+
+    @property
+    def concierge_rate(self) -> float:
+        """Concierge token bucket refill, in messages per second."""
+        return self.concierge_max_messages_per_window / self.concierge_window_seconds
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        load_dotenv()
+        admin_ids = _parse_admin_ids(os.getenv("ADMIN_IDS", ""))  # comma separated
+        return cls(
+            bot_token=os.getenv("BOT_TOKEN", ""),
+            admin_ids=frozenset(admin_ids),
+            admin_chat_id=admin_ids[0] if admin_ids else 0,
+            house_id=os.getenv("HOUSE_ID", "house1"),
+            auth_mode=os.getenv("AUTH_MODE", "code"),
+            access_days=int(os.getenv("ACCESS_DAYS", "30")),
+            db_path=os.getenv("DB_PATH", "./house-bots.db"),
+            concierge_min_interval_seconds=int(os.getenv("CONCIERGE_MIN_INTERVAL_SECONDS", "2")),
+            concierge_window_seconds=int(os.getenv("CONCIERGE_WINDOW_SECONDS", "60")),
+            concierge_max_messages_per_window=int(os.getenv("CONCIERGE_MAX_MESSAGES_PER_WINDOW", "20")),
+            max_media_size_mb=int(os.getenv("MAX_MEDIA_SIZE_MB", "16")),
+            state_ttl_minutes=int(os.getenv("STATE_TTL_MINUTES", "60")),
+            redis_url=os.getenv("REDIS_URL", ""),
+        )
@@ -1,21 +1,82 @@
 from __future__ import annotations
+import asyncio
+import os
+import sqlite3
 import aiosqlite
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# Applied once per connection: WAL lets readers proceed during writes and
+# synchronous=NORMAL drops the per-commit fsync that WAL does not need.
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=5000;
+PRAGMA cache_size=-20000;
+PRAGMA temp_store=MEMORY;
+PRAGMA foreign_keys=ON;
+"""
+
+# Lock wait for the synchronous _fast reader before falling back to the reader pool
+FAST_BUSY_TIMEOUT_MS = 50
+
+_SLASH_TABLE = str.maketrans("\\", "/")
+
+
+def normalize_content_path(content_path: str) -> str:
+    """Content paths are stored with forward slashes regardless of the admin's OS."""
+    return content_path.translate(_SLASH_TABLE)
+
+
+async def _connect(path: str, read_only: bool = False) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(path)
+    conn.row_factory = aiosqlite.Row
+    await conn.executescript(PRAGMAS)
+    if read_only:
+        await conn.execute("PRAGMA query_only=1")
+    return conn
+
 
 class Database:
-    def __init__(self, path: str):
+    def __init__(self, path: str, readers: Optional[int] = None):
         self.path = path
+        self.readers = readers or min(4, os.cpu_count() or 1)
+        # One writer connection, serialized by a lock, plus a pool of readers
+        # that run concurrently under WAL.
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._read_pool: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+        self._read_conns: List[aiosqlite.Connection] = []
+        # Plain sqlite3 reader for primary-key lookups: they finish in microseconds
+        # under WAL, less than aiosqlite's hop to its worker thread and back.
+        self._fast: Optional[sqlite3.Connection] = None
+
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _write(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._write_lock:
+            yield self._writer
 
     async def init(self):
-        async with aiosqlite.connect(self.path) as db:
+        if self._writer is None:
+            self._writer = await _connect(self.path)
+        async with self._write() as db:
             await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 first_seen TEXT,
-                access_until TEXT
+                access_until INTEGER
             )
             """)
+            await self._migrate_access_until(db)
             await db.execute("""
             CREATE TABLE IF NOT EXISTS codes (
                 code INTEGER PRIMARY KEY,
@@ -32,6 +93,8 @@ class Database:
                 FOREIGN KEY (code) REFERENCES codes (code)
             )
             """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_code_usage_code ON code_usage(code)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_code_usage_user ON code_usage(user_id, used_at)")
             # Store photos associated with content
             await db.execute("""
             CREATE TABLE IF NOT EXISTS photos (
@@ -39,97 +102,177 @@ class Database:
                 content_path TEXT NOT NULL,
                 photo_file TEXT NOT NULL,
                 added_at TEXT NOT NULL,
+                tg_file_id TEXT,
                 UNIQUE(content_path)
             )
             """)
+            async with db.execute("SELECT 1 FROM pragma_table_info('photos') WHERE name='tg_file_id'") as cur:
+                if await cur.fetchone() is None:
+                    await db.execute("ALTER TABLE photos ADD COLUMN tg_file_id TEXT")
             await db.commit()
+        # Readers are opened after the schema exists and WAL is switched on
+        if self._read_pool is None:
+            self._read_pool = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await _connect(self.path, read_only=True)
+                self._read_conns.append(conn)
+                self._read_pool.put_nowait(conn)
+        if self._fast is None:
+            self._fast = sqlite3.connect(self.path)
+            self._fast.row_factory = sqlite3.Row
+            self._fast.executescript(PRAGMAS)
+            self._fast.execute("PRAGMA query_only=1")
+            # It runs on the event loop: never wait long on a lock, use the reader pool instead
+            self._fast.execute(f"PRAGMA busy_timeout={FAST_BUSY_TIMEOUT_MS}")
+
+    async def _migrate_access_until(self, db: aiosqlite.Connection):
+        """Older databases stored access_until as ISO text; rebuild the table with
+        INTEGER unix seconds (TEXT affinity would turn stored ints back into strings)."""
+        async with db.execute("SELECT type FROM pragma_table_info('users') WHERE name='access_until'") as cur:
+            row = await cur.fetchone()
+        if not row or row[0].upper() == "INTEGER":
+            return
+        await db.executescript("""
+        BEGIN;
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY,
+            first_seen TEXT,
+            access_until INTEGER
+        );
+        INSERT INTO users_new(user_id, first_seen, access_until)
+            SELECT user_id, first_seen, CAST(strftime('%s', access_until) AS INTEGER) FROM users;
+        DROP TABLE users;
+        ALTER TABLE users_new RENAME TO users;
+        COMMIT;
+        """)
+
+    async def close(self):
+        for conn in self._read_conns:
+            await conn.close()
+        self._read_conns = []
+        self._read_pool = None
+        if self._fast is not None:
+            self._fast.close()
+            self._fast = None
+        if self._writer is not None:
+            # Refresh planner statistics for tables whose usage changed this session
+            await self._writer.execute("PRAGMA optimize")
+            await self._writer.close()
+            self._writer = None
+
+    async def _fast_fetchone(self, sql: str, params: tuple) -> Optional[sqlite3.Row]:
+        """Point lookup on the synchronous reader; if the database is busy (checkpoint,
+        lock) longer than FAST_BUSY_TIMEOUT_MS, retry on the async reader pool."""
+        try:
+            return self._fast.execute(sql, params).fetchone()
+        except sqlite3.OperationalError:
+            async with self._read() as db:
+                rows = await db.execute_fetchall(sql, params)
+            return rows[0] if rows else None
 
     async def get_user(self, user_id: int) -> Optional[dict]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM users WHERE user_id=?", (user_id,)) as cur:
-                row = await cur.fetchone()
-                return dict(row) if row else None
+        row = await self._fast_fetchone("SELECT user_id, first_seen, access_until FROM users WHERE user_id=?", (user_id,))
+        return dict(row) if row else None
+
+    async def _upsert_user_access(self, db: aiosqlite.Connection, user_id: int, days: int, now: datetime):
+        # Unix seconds, so access checks are a plain int compare
+        access_until = int((now + timedelta(days=days)).timestamp())
+        await db.execute(
+            "INSERT INTO users(user_id, first_seen, access_until) VALUES(?,?,?)\n             ON CONFLICT(user_id) DO UPDATE SET access_until=excluded.access_until",
+            (user_id, now.isoformat(), access_until),
+        )
 
     async def upsert_user_access(self, user_id: int, days: int):
-        now = datetime.now(timezone.utc)
-        access_until = now + timedelta(days=days)
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute(
-                "INSERT INTO users(user_id, first_seen, access_until) VALUES(?,?,?)\n                 ON CONFLICT(user_id) DO UPDATE SET access_until=excluded.access_until",
-                (user_id, now.isoformat(), access_until.isoformat()),
-            )
+        async with self._write() as db:
+            await self._upsert_user_access(db, user_id, days, datetime.now(timezone.utc))
             await db.commit()
 
     async def consume_code(self, code: int, user_id: int, days: int) -> Tuple[bool, Optional[str]]:
         """Check if code is valid and grant access. Code can be used by multiple users. Return (ok, house_id)."""
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM codes WHERE code=?", (code,)) as cur:
-                row = await cur.fetchone()
-                if not row:
+        # One clock read per redemption, shared by the usage log and the access window
+        now = datetime.now(timezone.utc)
+        async with self._write() as db:
+            try:
+                # Validate the code and log its usage (analytics, reuse is allowed) in one statement
+                rows = await db.execute_fetchall(
+                    "INSERT INTO code_usage(code, user_id, used_at) SELECT code, ?, ? FROM codes WHERE code=?\n"
+                    " RETURNING (SELECT house_id FROM codes WHERE codes.code=code_usage.code)",
+                    (user_id, now.isoformat(), code)
+                )
+                if not rows:
+                    await db.rollback()
                     return False, None
-                house_id = row["house_id"]
-            
-            # Log code usage for analytics (without blocking reuse)
-            now = datetime.now(timezone.utc).isoformat()
-            await db.execute(
-                "INSERT INTO code_usage(code, user_id, used_at) VALUES(?,?,?)",
-                (code, user_id, now)
-            )
-            await db.commit()
-            
-        await self.upsert_user_access(user_id, days)
-        return True, house_id
+                await self._upsert_user_access(db, user_id, days, now)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        return True, rows[0][0]
 
-    async def load_codes_from_csv(self, csv_path: str):
+    async def load_codes_from_csv(self, csv_path: str, batch_size: int = 10_000):
         import csv
-        async with aiosqlite.connect(self.path) as db:
+        from itertools import islice
+        async with self._write() as db:
             with open(csv_path, newline='') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    code = int(row["code"])
-                    house_id = row["house_id"].strip()
-                    await db.execute(
-                        "INSERT OR IGNORE INTO codes(code, house_id) VALUES(?,?)",
-                        (code, house_id)
-                    )
-            await db.commit()
+                rows = ((int(row["code"]), row["house_id"].strip()) for row in csv.DictReader(f))
+                # One transaction per batch keeps memory bounded on large files
+                while batch := list(islice(rows, batch_size)):
+                    await db.execute("BEGIN")
+                    try:
+                        await db.executemany(
+                            "INSERT OR IGNORE INTO codes(code, house_id) VALUES(?,?)",
+                            batch
+                        )
+                        await db.commit()
+                    except BaseException:
+                        # Don't leave the shared writer connection inside an open transaction
+                        await db.rollback()
+                        raise
 
-    async def add_photo(self, content_path: str, photo_file: str):
-        """Add or replace photo for content."""
-        # Normalize path to use forward slashes
-        normalized_path = content_path.replace('\\', '/')
+    async def add_photo(self, content_path: str, photo_file: str, tg_file_id: Optional[str] = None):
+        """Add or replace photo for content. tg_file_id is the Telegram file_id if already known."""
+        normalized_path = normalize_content_path(content_path)
         now = datetime.now(timezone.utc).isoformat()
-        async with aiosqlite.connect(self.path) as db:
+        async with self._write() as db:
             await db.execute(
-                "INSERT OR REPLACE INTO photos(content_path, photo_file, added_at) VALUES(?,?,?)",
-                (normalized_path, photo_file, now)
+                "INSERT OR REPLACE INTO photos(content_path, photo_file, added_at, tg_file_id) VALUES(?,?,?,?)",
+                (normalized_path, photo_file, now, tg_file_id)
             )
             await db.commit()
 
     async def get_photo(self, content_path: str) -> Optional[str]:
         """Get photo filename for content."""
-        # Normalize path to use forward slashes for lookup
-        normalized_path = content_path.replace('\\', '/')
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT photo_file FROM photos WHERE content_path=?", (normalized_path,)) as cur:
-                row = await cur.fetchone()
-                return row["photo_file"] if row else None
-
-    async def delete_photo(self, content_path: str) -> bool:
-        """Delete photo for content. Returns True if photo was deleted."""
-        # Normalize path to use forward slashes
-        normalized_path = content_path.replace('\\', '/')
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("DELETE FROM photos WHERE content_path=?", (normalized_path,))
+        normalized_path = normalize_content_path(content_path)
+        row = await self._fast_fetchone("SELECT photo_file FROM photos WHERE content_path=?", (normalized_path,))
+        return row["photo_file"] if row else None
+
+    async def set_photo_file_id(self, content_path: str, file_id: str):
+        """Remember Telegram's file_id for an uploaded photo so it can be resent without uploading."""
+        async with self._write() as db:
+            await db.execute(
+                "UPDATE photos SET tg_file_id=? WHERE content_path=?",
+                (file_id, normalize_content_path(content_path))
+            )
+            await db.commit()
+
+    async def photo_file_ids(self) -> Dict[str, str]:
+        """content_path -> Telegram file_id for photos that were already uploaded once."""
+        async with self._read() as db:
+            rows = await db.execute_fetchall("SELECT content_path, tg_file_id FROM photos WHERE tg_file_id IS NOT NULL")
+        return {row[0]: row[1] for row in rows}
+
+    async def delete_photo(self, content_path: str) -> Optional[str]:
+        """Delete photo for content. Returns the deleted photo's filename, or None if there was none."""
+        normalized_path = normalize_content_path(content_path)
+        async with self._write() as db:
+            rows = await db.execute_fetchall(
+                "DELETE FROM photos WHERE content_path=? RETURNING photo_file", (normalized_path,)
+            )
             await db.commit()
-            return cursor.rowcount > 0
+        return rows[0][0] if rows else None
 
     async def list_photos(self):
         """List all photos."""
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT content_path, photo_file FROM photos ORDER BY content_path") as cur:
-                return [dict(row) async for row in cur]
+        async with self._read() as db:
+            rows = await db.execute_fetchall("SELECT content_path, photo_file FROM photos ORDER BY content_path")
+        return [dict(row) for row in rows]
@@ -1,9 +1,26 @@
 from __future__ import annotations
+import os
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import yaml
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # optional speedup
+    import json
+    _json_loads = json.loads
+
+# libyaml's C loader parses several times faster; fall back when PyYAML was built without it
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _load_yaml(p: Path) -> Any:
+    return yaml.load(p.read_text(encoding="utf-8"), Loader=_YamlLoader)
+
+
 @dataclass
 class House:
     id: str
@@ -24,7 +41,7 @@ class Activity:
     link_guide_id: Optional[str] = None
     links: Optional[list[str]] = None
     photos: Optional[list[str]] = None
-    months: Optional[list[int]] = None  # 1..12
+    months: Optional[frozenset[int]] = None  # 1..12
 
     def to_markdown(self) -> str:
         # Use bold formatting that's safer for Telegram
@@ -37,70 +54,168 @@ class Activity:
             parts.append(link_text)
         return "\n\n".join([p for p in parts if p])
 
+def _parse_guide(p: Path) -> Guide:
+    content = p.read_text(encoding="utf-8")
+    # Use first line as title, fallback to filename if empty
+    lines = content.strip().split('\n')
+    title = lines[0].strip() if lines and lines[0].strip() else p.stem.replace("_", " ").title()
+    return Guide(id=p.stem, title=title, content_md=content)
+
+
+def _parse_activities(p: Path) -> List[Activity]:
+    # activities.json parses much faster than YAML; same list-of-objects layout
+    data = (_json_loads(p.read_bytes()) if p.suffix == ".json" else _load_yaml(p)) or []
+    res: List[Activity] = []
+    for item in data:
+        months = item.get("months")
+        res.append(Activity(
+            id=str(item.get("id")),
+            title=item.get("title", ""),
+            description_md=item.get("description_md", ""),
+            link_guide_id=item.get("link_guide_id"),
+            links=item.get("links"),
+            photos=item.get("photos"),
+            months=frozenset(months) if months else None,  # set: O(1) season checks
+        ))
+    return res
+
+
+# Parsed files kept per loader; a house has a few dozen, the bound only matters for stray paths
+CACHE_MAX = 512
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+def _walk_files(root: str, base: str, files: List[str], dirs: List[Tuple[str, int]]):
+    """Depth-first, name-ordered walk with os.scandir; DirEntry type checks need no extra stat."""
+    dirs.append((root, _mtime_ns(root)))
+    try:
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for e in entries:
+        if e.name.startswith("."):
+            continue  # editor swap files, .DS_Store and the like aren't content
+        if e.is_dir(follow_symlinks=False):
+            _walk_files(e.path, base, files, dirs)
+        elif e.is_file():
+            files.append(os.path.relpath(e.path, base).replace(os.sep, "/"))
+
+
 class ContentLoader:
     def __init__(self, base_path: Path):
         self.base = base_path
+        # (kind, path) -> (st_mtime_ns, parsed value), least recently used first;
+        # edits on disk invalidate by mtime
+        self._cache: OrderedDict[Tuple[str, Path], Tuple[int, Any]] = OrderedDict()
+        # house_id -> (mtimes of every directory walked, file listing)
+        self._listings: Dict[str, Tuple[List[Tuple[str, int]], List[str]]] = {}
+        # house_id -> (activities list it was built from, id -> Activity)
+        self._activity_index: Dict[str, Tuple[List[Activity], Dict[str, Activity]]] = {}
 
     def _house_dir(self, house_id: str) -> Path:
         return self.base / house_id
 
+    def _cached(self, kind: str, p: Path, parse: Callable[[Path], Any]) -> Any:
+        """Return parse(p), reusing the last result while the file mtime is unchanged.
+        Raises FileNotFoundError if the file is missing."""
+        key = (kind, p)
+        try:
+            mtime = p.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._cache.pop(key, None)
+            raise
+        hit = self._cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            self._cache.move_to_end(key)
+            return hit[1]
+        value = parse(p)
+        self._cache[key] = (mtime, value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > CACHE_MAX:
+            self._cache.popitem(last=False)
+        return value
+
     def load_house(self, house_id: str) -> Optional[House]:
-        p = self._house_dir(house_id) / "house.yaml"
-        if not p.exists():
+        def parse(p: Path) -> House:
+            data = _load_yaml(p) or {}
+            return House(id=house_id, name=data.get("name", house_id), concierge_text=data.get("concierge_text"))
+        try:
+            return self._cached("house", self._house_dir(house_id) / "house.yaml", parse)
+        except FileNotFoundError:
             return None
-        data = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
-        return House(id=house_id, name=data.get("name", house_id), concierge_text=data.get("concierge_text"))
 
     def read_markdown(self, house_id: str, rel_path: str) -> str:
-        p = self._house_dir(house_id) / rel_path
-        if not p.exists():
+        try:
+            return self._cached("text", self._house_dir(house_id) / rel_path, lambda p: p.read_text(encoding="utf-8"))
+        except FileNotFoundError:
             return "Пока пусто."
-        return p.read_text(encoding="utf-8")
 
     def list_guides(self, house_id: str) -> List[Guide]:
         d = self._house_dir(house_id) / "guides"
         res: List[Guide] = []
         if d.exists():
             for p in sorted(d.glob("*.md")):
-                gid = p.stem
-                content = p.read_text(encoding="utf-8")
-                # Use first line as title, fallback to filename if empty
-                lines = content.strip().split('\n')
-                title = lines[0].strip() if lines and lines[0].strip() else gid.replace("_", " ").title()
-                res.append(Guide(id=gid, title=title, content_md=content))
+                try:
+                    res.append(self._cached("guide", p, _parse_guide))
+                except FileNotFoundError:
+                    continue
         return res
 
     def get_guide(self, house_id: str, guide_id: str) -> Optional[Guide]:
-        p = self._house_dir(house_id) / "guides" / f"{guide_id}.md"
-        if not p.exists():
+        try:
+            return self._cached("guide", self._house_dir(house_id) / "guides" / f"{guide_id}.md", _parse_guide)
+        except FileNotFoundError:
             return None
-        content = p.read_text(encoding="utf-8")
-        # Use first line as title, fallback to filename if empty
-        lines = content.strip().split('\n')
-        title = lines[0].strip() if lines and lines[0].strip() else guide_id.replace("_", " ").title()
-        return Guide(id=guide_id, title=title, content_md=content)
 
     def list_activities(self, house_id: str) -> List[Activity]:
-        p = self._house_dir(house_id) / "activities.yaml"
-        if not p.exists():
-            return []
-        data = yaml.safe_load(p.read_text(encoding="utf-8")) or []
-        res: List[Activity] = []
-        for item in data:
-            res.append(Activity(
-                id=str(item.get("id")),
-                title=item.get("title", ""),
-                description_md=item.get("description_md", ""),
-                link_guide_id=item.get("link_guide_id"),
-                links=item.get("links"),
-                photos=item.get("photos"),
-                months=item.get("months"),
-            ))
-        return res
+        base = self._house_dir(house_id)
+        for name in ("activities.json", "activities.yaml"):
+            try:
+                return self._cached("activities", base / name, _parse_activities)
+            except FileNotFoundError:
+                continue
+        return []
 
-    def get_activity(self, house_id: str, activity_id: str) -> Optional[Activity]:
-        for a in self.list_activities(house_id):
-            if a.id == activity_id:
-                return a
-        return None
+    def list_content_files(self, house_id: str) -> List[str]:
+        """Paths (relative to the house dir) of editable content: texts/, guides/ and activities.json/.yaml.
+        Cached until any of the walked directories changes."""
+        hit = self._listings.get(house_id)
+        if hit is not None and all(_mtime_ns(d) == m for d, m in hit[0]):
+            return hit[1]
+        base = str(self._house_dir(house_id))
+        dirs: List[Tuple[str, int]] = [(base, _mtime_ns(base))]
+        files: List[str] = []
+        for sub in ("texts", "guides"):
+            _walk_files(os.path.join(base, sub), base, files, dirs)
+        for name in ("activities.json", "activities.yaml"):
+            if os.path.isfile(os.path.join(base, name)):
+                files.append(name)
+        self._listings[house_id] = (dirs, files)
+        return files
 
+    def preload(self, house_id: str) -> int:
+        """Warm the cache with the house card, every texts/*.md, the guides and activities.
+        Later reads only stat() the file. Returns the number of text files loaded."""
+        self.load_house(house_id)
+        texts = sorted((self._house_dir(house_id) / "texts").glob("*.md"))
+        for p in texts:
+            self.read_markdown(house_id, f"texts/{p.name}")
+        self.list_guides(house_id)
+        self.list_activities(house_id)
+        return len(texts)
+
+    def get_activity(self, house_id: str, activity_id: str) -> Optional[Activity]:
+        acts = self.list_activities(house_id)
+        hit = self._activity_index.get(house_id)
+        # list_activities returns the same cached list until the file changes
+        if hit is None or hit[0] is not acts:
+            hit = (acts, {a.id: a for a in acts})
+            self._activity_index[house_id] = hit
+        return hit[1].get(activity_id)
@@ -1,277 +1,397 @@
 from __future__ import annotations
 import asyncio
+import atexit
+import contextlib
 import logging
-import os
+import queue
 from datetime import datetime, timedelta, timezone
 import re
+import os
 import sys
+import tempfile
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (CallbackQuery, InlineKeyboardButton,
                            InlineKeyboardMarkup, Message, ReplyKeyboardMarkup,
-                           KeyboardButton, FSInputFile)
-from aiogram.client.default import DefaultBotProperties
-from dotenv import load_dotenv
-
-from .db import Database
+                           KeyboardButton, FSInputFile, InputMediaPhoto,
+                           InputMediaVideo)
+from aiogram.client.default import Default, DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from .config import Config
+from .db import Database, normalize_content_path
+from .ratelimit import SendLimiter, send_with_retry
+from .storage import make_storage
 from .loader import ContentLoader, Activity, Guide
 from .utils import month_in_season
 
 # FSM States
 class AuthStates(StatesGroup):
     waiting_for_code = State()
-    waiting_for_photo = State()  # Admin waiting for photo upload
 
 class ConciergeStates(StatesGroup):
     waiting_for_message = State()  # User is in concierge mode, waiting for message
     waiting_for_media = State()    # User can send additional media to their message
 
-# Basic logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+class AdminStates(StatesGroup):
+    replying = State()  # next admin message goes to data["target"]
+    editing = State()   # next admin text replaces data["rel_path"]
+    uploading_photo = State()  # next admin photo is attached to data["content_path"]
+
+# Basic logging. Handlers only enqueue records; a listener thread does the formatting
+# and the blocking stream writes, so a slow stdout never stalls the event loop.
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, _log_handler)
+# QueueHandler pre-renders the message (args, traceback); the listener adds time/level
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)], format="%(message)s")
+_log_listener.start()
+atexit.register(_log_listener.stop)  # flushes queued records on exit
 logger = logging.getLogger("house-bots")
 
-# Globals via env
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "")  # Multiple admin IDs separated by comma
-HOUSE_ID = os.getenv("HOUSE_ID", "house1")
-AUTH_MODE = os.getenv("AUTH_MODE", "code")  # code | phone
-ACCESS_DAYS = int(os.getenv("ACCESS_DAYS", "30"))
-DB_PATH = os.getenv("DB_PATH", "./house-bots.db")
-
-# Security and performance settings
-CONCIERGE_MIN_INTERVAL_SECONDS = int(os.getenv("CONCIERGE_MIN_INTERVAL_SECONDS", "2"))
-CONCIERGE_WINDOW_SECONDS = int(os.getenv("CONCIERGE_WINDOW_SECONDS", "60"))
-CONCIERGE_MAX_MESSAGES_PER_WINDOW = int(os.getenv("CONCIERGE_MAX_MESSAGES_PER_WINDOW", "20"))
-MAX_MEDIA_SIZE_MB = int(os.getenv("MAX_MEDIA_SIZE_MB", "16"))
-
-# Parse admin IDs
-ADMIN_IDS = []
-if ADMIN_IDS_STR:
-    try:
-        ADMIN_IDS = [int(admin_id.strip()) for admin_id in ADMIN_IDS_STR.split(",") if admin_id.strip()]
-        logger.info(f"Loaded {len(ADMIN_IDS)} admin IDs: {ADMIN_IDS}")
-    except ValueError as e:
-        logger.error(f"Invalid ADMIN_IDS format: {ADMIN_IDS_STR}. Error: {e}")
-        ADMIN_IDS = []
+loader = ContentLoader(base_path=Path(__file__).resolve().parent.parent.parent / "content")
 
-# Keep backward compatibility with old ADMIN_CHAT_ID
-ADMIN_CHAT_ID = ADMIN_IDS[0] if ADMIN_IDS else 0
 
-if not BOT_TOKEN:
-    logger.warning("BOT_TOKEN is not set. Fill .env before running in production.")
+def photos_dir(config: Config) -> Path:
+    return loader._house_dir(config.house_id) / "photos"
 
-loader = ContentLoader(base_path=Path(__file__).resolve().parent.parent.parent / "content")
 
-# Admin state (in-memory)
-ADMIN_REPLY_TARGET: Dict[int, int] = {}  # admin_id -> target_user_id
-ADMIN_EDIT_PENDING: Dict[int, str] = {}  # admin_id -> rel_path to write
-ADMIN_PHOTO_PENDING: Dict[int, str] = {}  # admin_id -> content_path waiting for photo
+@lru_cache(maxsize=1)
+def resolved_house_dir(house_id: str) -> Path:
+    """The bot serves a single house, so this is resolved once; admin edits only resolve the target."""
+    return loader._house_dir(house_id).resolve()
 
-# In-memory stores for security/rate limits and simple caches
-CONCIERGE_RL: Dict[int, Dict[str, int]] = {}
-HOUSE_CACHE: Dict[str, dict] = {}
-MARKDOWN_CACHE: Dict[tuple, str] = {}
 
+# user_id -> access_until (unix seconds, 0 = none), least recently used first.
+# Access only changes through process_code, which drops the entry.
+AUTH_CACHE: OrderedDict[int, int] = OrderedDict()
+AUTH_CACHE_MAX = 10_000
 
-def sanitize_markdown(text: str) -> str:
-    """Remove Telegram Markdown special characters to prevent injection when parse mode is enabled."""
-    if not text:
-        return ""
-    return re.sub(r"[*_`\[\]()>~#\+\-=|{}\.!]", "", text)
+# Concierge rate limit: token bucket per user, user_id -> (tokens, monotonic time of last accepted message).
+# A bucket idle for a whole window is full again, i.e. the same as no entry, so those get swept.
+CONCIERGE_RL: Dict[int, Tuple[float, float]] = {}
+_concierge_next_sweep = 0.0
 
+# listing style -> (file list it was rendered from, text) for the admin file listings
+CONTENT_LISTINGS: Dict[str, Tuple[List[str], str]] = {}
 
-def get_house_cached(house_id: str):
-    cached = HOUSE_CACHE.get(house_id)
-    if cached is not None:
-        return cached
-    house = loader.load_house(house_id)
-    HOUSE_CACHE[house_id] = house
-    return house
+# content_path -> Telegram file_id of its photo; loaded from the photos table at startup
+# and filled after each first upload
+PHOTO_FILE_IDS: Dict[str, str] = {}
+
+# Album items arrive as separate updates sharing media_group_id; they are buffered
+# and forwarded with one send_media_group once no new item came for this long
+ALBUM_FLUSH_DELAY = 1.0
+ALBUM_MAX_ITEMS = 10  # send_media_group limit
+ALBUM_BUFFER: Dict[str, list[Message]] = {}
+ALBUM_TASKS: Dict[str, asyncio.Task] = {}  # also keeps the pending flush tasks referenced
+# Background admin photo saves; the loop only holds weak references to tasks
+PHOTO_SAVE_TASKS: set[asyncio.Task] = set()
+
+# Caps concurrent Bot API calls when fanning out to admins (Telegram's bot-wide limit is ~30 msg/s)
+ADMIN_SEND_CONCURRENCY = asyncio.Semaphore(30)
+# Paces admin-bound sends and admin replies to users under Telegram's limits
+# (30 msg/s overall, 20 msg/min per chat) so bursts wait briefly here instead of getting 429s
+ADMIN_SEND_LIMITER = SendLimiter(global_per_second=30, per_chat_per_minute=20)
 
 
-def read_markdown_cached(house_id: str, rel_path: str) -> str:
-    key = (house_id, rel_path)
-    cached = MARKDOWN_CACHE.get(key)
-    if cached is not None:
-        return cached
-    content = loader.read_markdown(house_id, rel_path)
-    MARKDOWN_CACHE[key] = content
-    return content
+CONSENT_RE = re.compile("разрешаю публикацию", re.IGNORECASE)
+# Substring keywords for free-text routing, each set matched in one regex pass over the casefolded text
+CONCIERGE_KEYWORDS_RE = re.compile("|".join(map(re.escape, [
+    "вопрос", "помощь", "помогите", "как", "где", "когда", "что", "почему",
+    "консьерж", "консьержу", "администратор", "админу",
+])))
+FEEDBACK_KEYWORDS_RE = re.compile("|".join(map(re.escape, [
+    "отзыв", "жалоба", "предложение", "идея", "комментарий", "мнение",
+])))
+# str.translate deletes the characters in one C-level pass, cheaper than a regex sub
+MARKDOWN_SPECIALS_TABLE = str.maketrans("", "", "*_`[]()>~#+-=|{}.!")
+# Lighter cleanup for forwarded media captions: just the characters that open Markdown entities
+CAPTION_SPECIALS_TABLE = str.maketrans("", "", "*_`[]")
 
 
-def allow_concierge_message(user_id: int) -> bool:
-    now_ts = int(datetime.now(timezone.utc).timestamp())
+def sanitize_markdown(text: str) -> str:
+    """Remove Telegram Markdown special characters to prevent injection when parse mode is enabled."""
+    if not text:
+        return ""
+    return text.translate(MARKDOWN_SPECIALS_TABLE)
+
+
+async def is_authorized(user_id: int, db: Database) -> bool:
+    """Compare the user's access_until (unix seconds) with now, reading the DB only on a cache miss."""
+    access_until = AUTH_CACHE.get(user_id)
+    if access_until is None:
+        profile = await db.get_user(user_id)
+        access_until = (profile or {}).get("access_until") or 0
+        AUTH_CACHE[user_id] = access_until
+        if len(AUTH_CACHE) > AUTH_CACHE_MAX:
+            AUTH_CACHE.popitem(last=False)
+    else:
+        AUTH_CACHE.move_to_end(user_id)
+    return access_until > time.time()
+
+
+def allow_concierge_message(user_id: int, config: Config) -> bool:
+    global _concierge_next_sweep
+    now = time.monotonic()
+    if now >= _concierge_next_sweep:
+        for uid, (_, last) in list(CONCIERGE_RL.items()):
+            if now - last >= config.concierge_window_seconds:
+                del CONCIERGE_RL[uid]
+        _concierge_next_sweep = now + config.concierge_window_seconds
     rec = CONCIERGE_RL.get(user_id)
-    if rec:
+    if rec is None:
+        tokens = float(config.concierge_max_messages_per_window)
+    else:
+        tokens, last = rec
         # Enforce min interval
-        if now_ts - rec.get("last_ts", 0) < CONCIERGE_MIN_INTERVAL_SECONDS:
+        if now - last < config.concierge_min_interval_seconds:
             return False
-        # Enforce windowed count
-        if now_ts - rec.get("first_ts", now_ts) > CONCIERGE_WINDOW_SECONDS:
-            # reset window
-            CONCIERGE_RL[user_id] = {"first_ts": now_ts, "count": 1, "last_ts": now_ts}
-        else:
-            if rec.get("count", 0) >= CONCIERGE_MAX_MESSAGES_PER_WINDOW:
-                return False
-            rec["count"] = rec.get("count", 0) + 1
-            rec["last_ts"] = now_ts
-    else:
-        CONCIERGE_RL[user_id] = {"first_ts": now_ts, "count": 1, "last_ts": now_ts}
+        tokens = min(config.concierge_max_messages_per_window, tokens + (now - last) * config.concierge_rate)
+        if tokens < 1:
+            return False
+    CONCIERGE_RL[user_id] = (tokens - 1, now)
     return True
 
+def clock_now() -> str:
+    """Local wall-clock time as HH:MM:SS for admin notifications."""
+    return time.strftime("%H:%M:%S")
+
+
 async def ensure_db(db: Database):
     await db.init()
 
 # Keyboards
 
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMIN_IDS
-
-
-def main_menu_kb():
-    btns = [
-        [InlineKeyboardButton(text="Консьерж (9–21)", callback_data="concierge")],
-        [InlineKeyboardButton(text="Правила дома", callback_data="rules_house")],
-        [InlineKeyboardButton(text="Инвентарь", callback_data="rules_inventory")],
-        [InlineKeyboardButton(text="Как это работает?", callback_data="howto")],
-        [InlineKeyboardButton(text="Чем заняться?", callback_data="activities")],
-        [InlineKeyboardButton(text="Карта локаций", callback_data="map")],
-        [InlineKeyboardButton(text="Обратная связь", callback_data="feedback")],
-        [InlineKeyboardButton(text="Спецпредложения", callback_data="specials")],
-        [InlineKeyboardButton(text="Купить дом", callback_data="buy_house")],
-        [InlineKeyboardButton(text="Купить мебель", callback_data="buy_furniture")],
-        [InlineKeyboardButton(text="О проекте", callback_data="about")],
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=btns)
+def is_admin(user_id: int, config: Config) -> bool:
+    return user_id in config.admin_ids
 
 
-def guides_menu_kb(guides: list[Guide]):
-    rows = [[InlineKeyboardButton(text=g.title, callback_data=f"guide:{g.id}")] for g in guides]
+async def broadcast_to_admins(admin_ids: Iterable[int], send: Callable[[int], Awaitable[Any]], what: str) -> int:
+    """Call send(admin_id) for every admin concurrently, retrying flood control and network errors.
+    Returns the number of successful sends."""
+    async def send_one(admin_id: int) -> bool:
+        async with ADMIN_SEND_CONCURRENCY:
+            try:
+                await ADMIN_SEND_LIMITER.acquire(admin_id)
+                await send_with_retry(lambda: send(admin_id))
+            except Exception as e:
+                logger.error(f"Failed to send {what} to admin {admin_id}: {e}")
+                return False
+        logger.debug("Successfully sent %s to admin %s", what, admin_id)
+        return True
+
+    results = await asyncio.gather(*(send_one(admin_id) for admin_id in admin_ids))
+    return sum(results)
+
+
+# Static keyboards are built once; aiogram only serializes them per send
+MAIN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Консьерж (9–21)", callback_data="concierge")],
+    [InlineKeyboardButton(text="Правила дома", callback_data="rules_house")],
+    [InlineKeyboardButton(text="Инвентарь", callback_data="rules_inventory")],
+    [InlineKeyboardButton(text="Как это работает?", callback_data="howto")],
+    [InlineKeyboardButton(text="Чем заняться?", callback_data="activities")],
+    [InlineKeyboardButton(text="Карта локаций", callback_data="map")],
+    [InlineKeyboardButton(text="Обратная связь", callback_data="feedback")],
+    [InlineKeyboardButton(text="Спецпредложения", callback_data="specials")],
+    [InlineKeyboardButton(text="Купить дом", callback_data="buy_house")],
+    [InlineKeyboardButton(text="Купить мебель", callback_data="buy_furniture")],
+    [InlineKeyboardButton(text="О проекте", callback_data="about")],
+])
+
+
+@lru_cache(maxsize=64)
+def _list_menu_kb(prefix: str, items: tuple[tuple[str, str], ...]) -> InlineKeyboardMarkup:
+    """One button per (id, title) plus Back; memoized since the lists rarely change."""
+    rows = [[InlineKeyboardButton(text=title, callback_data=f"{prefix}:{item_id}")] for item_id, title in items]
     rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_main")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def back_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="back_main")]])
+def guides_menu_kb(guides: list[Guide]):
+    return _list_menu_kb("guide", tuple((g.id, g.title) for g in guides))
+
+
+BACK_KB = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="back_main")]])
+BACK_TO_GUIDES_KB = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="howto")]])
+BACK_TO_ACTIVITIES_KB = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="activities")]])
+CONCIERGE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отменить", callback_data="concierge_cancel")],
+    [InlineKeyboardButton(text="⬅️ В главное меню", callback_data="back_main")]
+])
+CONCIERGE_SENT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📱 Завершить диалог", callback_data="concierge_finish")],
+    [InlineKeyboardButton(text="⬅️ В меню", callback_data="back_main")]
+])
+ADMIN_PANEL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📁 Список файлов", callback_data="admin_ls")],
+])
+
+
+@lru_cache(maxsize=4096)
+def admin_reply_kb(user_id: int, label: str = "Ответить") -> InlineKeyboardMarkup:
+    """Reply button under a forwarded message; built once per user and reused."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=label, callback_data=f"admin_reply:{user_id}")]
+    ])
 
 
 def activities_menu_kb(activities: list[Activity]):
-    rows = []
-    for a in activities:
-        rows.append([InlineKeyboardButton(text=a.title, callback_data=f"activity:{a.id}")])
-    rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_main")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    return _list_menu_kb("activity", tuple((a.id, a.title) for a in activities))
 
 
-async def start_handler(message: Message, state: FSMContext, db: Database):
+async def start_handler(message: Message, state: FSMContext, db: Database, config: Config):
     user = message.from_user
     assert user
     # Clear any existing state first
     await state.clear()
     
     # Auth flow
-    if AUTH_MODE == "phone":
+    if config.auth_mode == "phone":
         # placeholder: allow after sharing contact
         kb = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, keyboard=[[KeyboardButton(text="Поделиться телефоном", request_contact=True)]] )
         await message.answer("Для доступа поделитесь номером телефона.", reply_markup=kb)
         return
     else:
         # code auth
-        profile = await db.get_user(user.id)
-        now = datetime.now(timezone.utc)
-        if profile and profile.get("access_until") and datetime.fromisoformat(profile["access_until"]) > now:
+        if await is_authorized(user.id, db):
             await message.answer("Добро пожаловать обратно!", reply_markup=None)
-            await show_main_menu(message)
+            await show_main_menu(message, config)
             return
         # Set waiting for code state
         await state.set_state(AuthStates.waiting_for_code)
         await message.answer("Добро пожаловать! Введите, пожалуйста, ваш числовой код доступа:")
 
 
-async def process_code(message: Message, state: FSMContext, db: Database):
+async def process_code(message: Message, state: FSMContext, db: Database, config: Config):
     code = message.text.strip() if message.text else ""
     if not code.isdigit():
         await message.answer("Код должен быть числом. Попробуйте ещё раз.")
         # Keep the state - still waiting for code
         return
-    ok, house_id = await db.consume_code(int(code), message.from_user.id, ACCESS_DAYS)
+    ok, house_id = await db.consume_code(int(code), message.from_user.id, config.access_days)
     if not ok:
         await message.answer("Код неверный или уже использован. Проверьте и введите снова.")
         # Keep the state - still waiting for code
         return
+    # Access changed: drop the cached answer so the next check reads the new access_until
+    AUTH_CACHE.pop(message.from_user.id, None)
     # Success - clear state and show menu
     await state.clear()
     await message.answer("Доступ предоставлен!", reply_markup=None)
-    await show_main_menu(message)
+    await show_main_menu(message, config)
 
 
-async def show_main_menu(message: Message):
-    house_id = HOUSE_ID  # одна папка контента на бот
-    house = get_house_cached(house_id)
+async def show_main_menu(message: Message, config: Config):
+    house_id = config.house_id  # одна папка контента на бот
+    house = loader.load_house(house_id)
     title = house.name if house else "Дом"
-    await message.answer(f"{title}. Главное меню:", reply_markup=main_menu_kb())
+    await message.answer(f"{title}. Главное меню:", reply_markup=MAIN_MENU_KB)
 
 
-async def send_content_with_photo(cb: CallbackQuery, db: Database, content_path: str, text_content: str, reply_markup, parse_mode=ParseMode.MARKDOWN):
+async def swap_message(cb: CallbackQuery, text: str, reply_markup=None, parse_mode: Any = Default("parse_mode")):
+    """Replace the callback's message with new text: one edit call instead of answer + delete.
+    Photo messages can't be edited into text, so they are still resent."""
+    msg = cb.message
+    if getattr(msg, "text", None) is not None:
+        try:
+            await msg.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            logger.warning(f"swap_message: edit failed, resending: {e}")
+    await msg.answer(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    await msg.delete()
+
+
+async def _delete_old_message(cb: CallbackQuery):
+    """Remove the message the new photo replaces. The photo is already sent, so a failure
+    (e.g. the message is older than 48h) is only logged, never treated as a failed send."""
+    try:
+        await cb.message.delete()
+    except Exception as e:
+        logger.warning(f"send_content_with_photo: could not delete previous message: {e}")
+
+
+async def send_content_with_photo(cb: CallbackQuery, db: Database, config: Config, content_path: str, text_content: str, reply_markup, parse_mode=ParseMode.MARKDOWN):
     """Helper function to send content with photo if available, fallback to text only"""
-    logger.info(f"send_content_with_photo: checking for photo at path '{content_path}'")
     photo_file = await db.get_photo(content_path)
-    logger.info(f"send_content_with_photo: db.get_photo returned '{photo_file}'")
+    logger.debug("send_content_with_photo: %r -> photo %r", content_path, photo_file)
     
     if photo_file:
-        photos_dir = loader._house_dir(HOUSE_ID) / "photos"
-        photo_path = photos_dir / photo_file
-        logger.info(f"send_content_with_photo: checking if photo exists at '{photo_path}'")
-        logger.info(f"send_content_with_photo: photos_dir exists: {photos_dir.exists()}")
-        logger.info(f"send_content_with_photo: photo_path exists: {photo_path.exists()}")
+        # Telegram keeps uploaded files; resend by file_id instead of re-uploading from disk
+        file_id = PHOTO_FILE_IDS.get(content_path)
+        if file_id:
+            edit_in_place = bool(getattr(cb.message, "photo", None))
+            try:
+                if edit_in_place:
+                    # Photo to photo: swap the media in place
+                    await cb.message.edit_media(
+                        InputMediaPhoto(media=file_id, caption=text_content, parse_mode=parse_mode),
+                        reply_markup=reply_markup,
+                    )
+                else:
+                    await cb.message.answer_photo(file_id, caption=text_content, parse_mode=parse_mode, reply_markup=reply_markup)
+            except Exception as e:
+                logger.warning(f"send_content_with_photo: cached file_id failed, re-uploading: {e}")
+                PHOTO_FILE_IDS.pop(content_path, None)
+            else:
+                if not edit_in_place:
+                    await _delete_old_message(cb)
+                return
+
+        photo_path = photos_dir(config) / photo_file
+        photo_exists = await asyncio.to_thread(photo_path.exists)
+        logger.debug("send_content_with_photo: %s exists: %s", photo_path, photo_exists)
         
-        if photo_path.exists():
-            logger.info(f"send_content_with_photo: photo found, sending photo with caption")
+        if photo_exists:
             try:
                 # For aiogram 3.x, use FSInputFile
                 input_file = FSInputFile(photo_path)
-                await cb.message.answer_photo(input_file, caption=text_content, parse_mode=parse_mode, reply_markup=reply_markup)
-                await cb.message.delete()
-                logger.info(f"send_content_with_photo: photo sent successfully")
-                return
+                sent = await cb.message.answer_photo(input_file, caption=text_content, parse_mode=parse_mode, reply_markup=reply_markup)
             except Exception as e:
                 logger.error(f"send_content_with_photo: error sending photo: {e}")
                 logger.exception("Full traceback:")
                 # Fallback to text on error
-                logger.info(f"send_content_with_photo: falling back to text due to error")
+            else:
+                logger.debug("send_content_with_photo: photo uploaded for %r", content_path)
+                if sent.photo:
+                    PHOTO_FILE_IDS[content_path] = sent.photo[-1].file_id
+                    try:
+                        await db.set_photo_file_id(content_path, sent.photo[-1].file_id)
+                    except Exception as e:
+                        logger.error(f"send_content_with_photo: failed to store file_id: {e}")
+                await _delete_old_message(cb)
+                return
         else:
             logger.warning(f"send_content_with_photo: photo file not found at '{photo_path}'")
-            # List available photos for debugging
-            if photos_dir.exists():
-                available_photos = list(photos_dir.glob("*"))
-                logger.info(f"send_content_with_photo: available photos in directory: {[p.name for p in available_photos]}")
-    else:
-        logger.info(f"send_content_with_photo: no photo found in database for '{content_path}'")
     
     # Fallback to text only
-    logger.info(f"send_content_with_photo: falling back to text-only message")
     try:
-        # Instead of edit_text, always answer a new message and delete the old one
-        await cb.message.answer(text_content, parse_mode=parse_mode, reply_markup=reply_markup)
-        await cb.message.delete() # Delete the original message
+        await swap_message(cb, text_content, reply_markup=reply_markup, parse_mode=parse_mode)
     except Exception as e:
         logger.error(f"send_content_with_photo: error sending text message fallback: {e}")
         await cb.answer("Ошибка при отправке контента", show_alert=True)
 
 
 # Concierge functions
-async def handle_concierge_start(cb: CallbackQuery, state: FSMContext):
+async def handle_concierge_start(cb: CallbackQuery, state: FSMContext, config: Config):
     """Start concierge conversation with proper state management"""
     user_id = cb.from_user.id
-    house = get_house_cached(HOUSE_ID)
+    house = loader.load_house(config.house_id)
     
     # Set concierge state
     await state.set_state(ConciergeStates.waiting_for_message)
@@ -280,40 +400,34 @@ async def handle_concierge_start(cb: CallbackQuery, state: FSMContext):
     text = (house.concierge_text if house and house.concierge_text else 
             "Вы в режиме консьержа. Напишите ваш вопрос или просьбу.")
     
-    # Create concierge keyboard
-    concierge_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отменить", callback_data="concierge_cancel")],
-        [InlineKeyboardButton(text="⬅️ В главное меню", callback_data="back_main")]
-    ])
-    
-    await cb.message.answer(
+    await swap_message(
+        cb,
         f"🏨 **Режим консьержа активирован**\n\n"
         f"{text}\n\n"
         f"📝 **Отправьте ваше сообщение одним или несколькими сообщениями**\n"
         f"📷 При необходимости прикрепите фото или видео\n\n"
         f"⏰ Режим работы: 9:00 - 21:00\n"
         f"💬 Все сообщения будут переданы администратору",
-        reply_markup=concierge_kb
+        reply_markup=CONCIERGE_KB
     )
-    await cb.message.delete()
     await cb.answer()
     
     logger.info(f"User {user_id} entered concierge mode")
 
 
-async def handle_concierge_message(message: Message, state: FSMContext, db: Database):
+async def handle_concierge_message(message: Message, state: FSMContext, db: Database, config: Config):
     """Handle message in concierge mode"""
     user = message.from_user
     text = message.text or ""
     # Simple rate limit to reduce spam
-    if not allow_concierge_message(user.id):
+    if not allow_concierge_message(user.id, config):
         await message.answer("Слишком часто. Подождите пару секунд и попробуйте снова.")
         return
     
-    logger.info(f"Processing concierge message from user {user.id}: {text[:50]}...")
+    logger.debug("Processing concierge message from user %s: %r", user.id, text[:50])
     
     # Send message to admins
-    if ADMIN_IDS:
+    if config.admin_ids:
         try:
             user_info = f"@{user.username}" if user.username else f"ID: {user.id}"
             if user.first_name:
@@ -321,26 +435,21 @@ async def handle_concierge_message(message: Message, state: FSMContext, db: Data
             
             payload = f"🏨 Сообщение консьержу\n\n"\
                      f"👤 От: {user_info}\n"\
-                     f"⏰ Время: {datetime.now().strftime('%H:%M:%S')}\n\n"\
+                     f"⏰ Время: {clock_now()}\n\n"\
                      f"💬 Сообщение:\n{text}"
             
             # Send to all admins with reply button
-            admin_kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✉️ Ответить", callback_data=f"admin_reply:{user.id}")]
-            ])
+            admin_kb = admin_reply_kb(user.id, "✉️ Ответить")
             
-            success_count = 0
-            for admin_id in ADMIN_IDS:
-                try:
-                    await message.bot.send_message(
-                        admin_id, payload,
-                        parse_mode=None,  # Отключаем парсинг Markdown для безопасности
-                        reply_markup=admin_kb
-                    )
-                    success_count += 1
-                    logger.info(f"Successfully sent concierge message to admin {admin_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send concierge message to admin {admin_id}: {e}")
+            success_count = await broadcast_to_admins(
+                config.admin_ids,
+                lambda admin_id: message.bot.send_message(
+                    admin_id, payload,
+                    parse_mode=None,  # Отключаем парсинг Markdown для безопасности
+                    reply_markup=admin_kb
+                ),
+                "concierge message",
+            )
             
             if success_count > 0:
                 # Confirm to user
@@ -349,10 +458,7 @@ async def handle_concierge_message(message: Message, state: FSMContext, db: Data
                     f"📧 Ваше сообщение передано {success_count} администратору(ам)\n"
                     f"⏱️ Ожидайте ответа в рабочее время (9:00-21:00)\n\n"
                     f"💡 Вы можете отправить дополнительные сообщения или медиафайлы",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="📱 Завершить диалог", callback_data="concierge_finish")],
-                        [InlineKeyboardButton(text="⬅️ В меню", callback_data="back_main")]
-                    ])
+                    reply_markup=CONCIERGE_SENT_KB
                 )
                 # Keep user in concierge mode for additional messages
                 await state.set_state(ConciergeStates.waiting_for_media)
@@ -361,35 +467,39 @@ async def handle_concierge_message(message: Message, state: FSMContext, db: Data
                     "❌ **Ошибка отправки сообщения**\n\n"
                     "К сожалению, не удалось доставить сообщение администраторам. "
                     "Попробуйте позже или обратитесь через другие каналы связи.",
-                    reply_markup=back_kb()
+                    reply_markup=BACK_KB
                 )
                 await state.clear()
         except Exception as e:
             logger.exception("Failed to process concierge message: %s", e)
             await message.answer(
                 "❌ Произошла ошибка при отправке сообщения. Попробуйте позже.",
-                reply_markup=back_kb()
+                reply_markup=BACK_KB
             )
             await state.clear()
     else:
         await message.answer(
             "⚠️ Администраторы сейчас недоступны. Попробуйте позже.",
-            reply_markup=back_kb()
+            reply_markup=BACK_KB
         )
         await state.clear()
 
 
-async def handle_concierge_media(message: Message, state: FSMContext):
+async def handle_concierge_media(message: Message, state: FSMContext, config: Config):
     """Handle media in concierge mode"""
     user = message.from_user
     # Rate limit media as well
-    if not allow_concierge_message(user.id):
+    if not allow_concierge_message(user.id, config):
         await message.answer("Слишком часто. Подождите пару секунд и попробуйте снова.")
         return
     
-    logger.info(f"Processing concierge media from user {user.id}")
+    logger.debug("Processing concierge media from user %s", user.id)
+    
+    if media_too_large(message, config):
+        await message.answer(f"Файл слишком большой (больше {config.max_media_size_mb} МБ) и не был отправлен. Попробуйте файл поменьше.")
+        return
     
-    if ADMIN_IDS:
+    if config.admin_ids:
         try:
             user_info = f"@{user.username}" if user.username else f"ID: {user.id}"
             if user.first_name:
@@ -397,284 +507,264 @@ async def handle_concierge_media(message: Message, state: FSMContext):
             
             caption = f"🏨 **Медиафайл от консьержа**\n\n"\
                      f"👤 От: {user_info}\n"\
-                     f"⏰ Время: {datetime.now().strftime('%H:%M:%S')}"
+                     f"⏰ Время: {clock_now()}"
             
             if message.caption:
                 caption += f"\n\n📝 **Описание:**\n{message.caption}"
             
-            # Admin keyboard
-            admin_kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="✉️ Ответить", callback_data=f"admin_reply:{user.id}")]
-            ])
+            # Same caption and keyboard for every admin
+            caption = sanitize_markdown(caption)
+            admin_kb = admin_reply_kb(user.id, "✉️ Ответить")
             
-            success_count = 0
-            for admin_id in ADMIN_IDS:
-                try:
-                    if message.photo:
-                        # Enforce simple size constraint if available
-                        if hasattr(message.photo[-1], 'file_size') and message.photo[-1].file_size and message.photo[-1].file_size > MAX_MEDIA_SIZE_MB * 1024 * 1024:
-                            logger.warning("Photo too large, skipping forwarding")
-                            continue
-                        await message.bot.send_photo(
-                            admin_id, message.photo[-1].file_id,
-                            caption=sanitize_markdown(caption),
-                            parse_mode=ParseMode.MARKDOWN,
-                            reply_markup=admin_kb
-                        )
-                    elif message.video:
-                        if hasattr(message.video, 'file_size') and message.video.file_size and message.video.file_size > MAX_MEDIA_SIZE_MB * 1024 * 1024:
-                            logger.warning("Video too large, skipping forwarding")
-                            continue
-                        await message.bot.send_video(
-                            admin_id, message.video.file_id,
-                            caption=sanitize_markdown(caption),
-                            parse_mode=ParseMode.MARKDOWN,
-                            reply_markup=admin_kb
-                        )
-                    elif message.document:
-                        await message.bot.send_document(
-                            admin_id, message.document.file_id,
-                            caption=sanitize_markdown(caption),
-                            parse_mode=ParseMode.MARKDOWN,
-                            reply_markup=admin_kb
-                        )
-                    success_count += 1
-                    logger.info(f"Successfully sent concierge media to admin {admin_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send concierge media to admin {admin_id}: {e}")
+            # copy_message clones photo/video/document server-side, one code path for all
+            success_count = await broadcast_to_admins(
+                config.admin_ids,
+                lambda admin_id: message.bot.copy_message(
+                    admin_id, message.chat.id, message.message_id,
+                    caption=caption,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=admin_kb
+                ),
+                "concierge media",
+            )
             
             if success_count > 0:
                 await message.answer(
                     f"✅ **Медиафайл отправлен!**\n\n"
                     f"📧 Файл передан {success_count} администратору(ам)\n"
                     f"💡 Можете отправить еще сообщения или завершить диалог",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="📱 Завершить диалог", callback_data="concierge_finish")],
-                        [InlineKeyboardButton(text="⬅️ В меню", callback_data="back_main")]
-                    ])
+                    reply_markup=CONCIERGE_SENT_KB
                 )
             else:
                 await message.answer(
                     "❌ Ошибка при отправке медиафайла. Попробуйте позже.",
-                    reply_markup=back_kb()
+                    reply_markup=BACK_KB
                 )
                 await state.clear()
         except Exception as e:
             logger.exception("Failed to process concierge media: %s", e)
             await message.answer(
                 "❌ Произошла ошибка. Попробуйте позже.",
-                reply_markup=back_kb()
+                reply_markup=BACK_KB
             )
             await state.clear()
     else:
         await message.answer(
             "⚠️ Администраторы недоступны.",
-            reply_markup=back_kb()
+            reply_markup=BACK_KB
         )
         await state.clear()
 
 
-async def callback_router(cb: CallbackQuery, state: FSMContext, db: Database):
-    data = cb.data or ""
-    house = get_house_cached(HOUSE_ID)
+def _render_panel_listing(house_id: str, files: List[str]) -> str:
+    listing = "\n".join(files) if files else "Нет файлов"
+    return f"Файлы контента (дом {house_id}):\n{listing}"
 
-    # Admin panel callbacks
-    if data == "admin_ls":
-        if not is_admin(cb.from_user.id):
-            await cb.answer("Недостаточно прав", show_alert=True)
-            return
-        base = loader._house_dir(HOUSE_ID)
-        files = []
-        for sub in [base / "texts", base / "guides"]:
-            if sub.exists():
-                for p in sorted(sub.glob("**/*")):
-                    if p.is_file():
-                        files.append(str(p.relative_to(base)))
-        if (base / "activities.yaml").exists():
-            files.append("activities.yaml")
-        listing = "\n".join(files) if files else "Нет файлов"
-        await cb.message.answer(f"Файлы контента (дом {HOUSE_ID}):\n{listing}", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="back_main")]]))
-        await cb.message.delete()
-        await cb.answer()
-        return
 
-    # Admin reply button
-    if data.startswith("admin_reply:"):
-        if not is_admin(cb.from_user.id):
-            await cb.answer("Недостаточно прав", show_alert=True)
-            return
-        target_str = data.split(":", 1)[1]
-        try:
-            target_user = int(target_str)
-        except ValueError:
-            await cb.answer("Некорректный адресат", show_alert=False)
-            return
-        ADMIN_REPLY_TARGET[cb.from_user.id] = target_user
-        await cb.message.answer(f"Введите ответ пользователю {target_user}. Ваше следующее сообщение будет отправлено ему.")
-        await cb.answer()
-        return
+def _render_command_listing(house_id: str, files: List[str]) -> str:
+    if not files:
+        return f"⚠️ Нет файлов в доме {house_id}"
+    listing = "\n".join(f"📄 {f}" for f in files)
+    return f"📁 **Файлы контента (дом {house_id}):**\n\n{listing}\n\nℹ️ Для редактирования используйте:\n`/put <путь>`"
+
+
+async def content_listing(house_id: str, style: str, render: Callable[[str, List[str]], str]) -> str:
+    """Rendered content listing, rebuilt only when the loader returns a new file list.
+    The directory stats/walk run in a worker thread to keep the event loop free."""
+    files = await asyncio.to_thread(loader.list_content_files, house_id)
+    hit = CONTENT_LISTINGS.get(style)
+    if hit is None or hit[0] is not files:
+        hit = (files, render(house_id, files))
+        CONTENT_LISTINGS[style] = hit
+    return hit[1]
 
-    if data == "back_main":
-        await cb.message.answer("Главное меню:", reply_markup=main_menu_kb())
-        await cb.message.delete()
-        await cb.answer()
-        return
 
-    if data == "concierge":
-        # Start concierge conversation with FSM state
-        await handle_concierge_start(cb, state)
+async def _cb_admin_ls(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    if not is_admin(cb.from_user.id, config):
+        await cb.answer("Недостаточно прав", show_alert=True)
         return
-    
-    # Concierge callbacks
-    if data == "concierge_cancel":
-        await state.clear()
-        await cb.message.answer("❌ Режим консьержа отменен.", reply_markup=main_menu_kb())
-        await cb.message.delete()
-        await cb.answer()
+    await swap_message(cb, await content_listing(config.house_id, "panel", _render_panel_listing), reply_markup=BACK_KB)
+    await cb.answer()
+
+
+async def _cb_admin_reply(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    if not is_admin(cb.from_user.id, config):
+        await cb.answer("Недостаточно прав", show_alert=True)
         return
-    
-    if data == "concierge_finish":
-        await state.clear()
-        await cb.message.answer("📱 **Диалог завершен**\n\nСпасибо за обращение! Возвращайтесь, если понадобится помощь.", reply_markup=main_menu_kb())
-        await cb.message.delete()
-        await cb.answer()
+    try:
+        target_user = int(rest)
+    except ValueError:
+        await cb.answer("Некорректный адресат", show_alert=False)
         return
+    await state.set_state(AdminStates.replying)
+    await state.set_data({"target": target_user})
+    await cb.message.answer(f"Введите ответ пользователю {target_user}. Ваше следующее сообщение будет отправлено ему.")
+    await cb.answer()
 
-    if data == "rules_house":
-        md = read_markdown_cached(HOUSE_ID, "texts/rules_house.md")
-        await send_content_with_photo(cb, db, "texts/rules_house.md", md, back_kb())
-        await cb.answer()
-        return
 
-    if data == "rules_inventory":
-        md = read_markdown_cached(HOUSE_ID, "texts/rules_inventory.md")
-        await send_content_with_photo(cb, db, "texts/rules_inventory.md", md, back_kb())
-        await cb.answer()
-        return
+async def _cb_back_main(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    await swap_message(cb, "Главное меню:", reply_markup=MAIN_MENU_KB)
+    await cb.answer()
 
-    if data == "howto":
-        guides = loader.list_guides(HOUSE_ID)
-        await cb.message.answer("Как это работает?", reply_markup=guides_menu_kb(guides))
-        await cb.message.delete()
-        await cb.answer()
-        return
 
-    if data.startswith("guide:"):
-        gid = data.split(":", 1)[1]
-        guide = loader.get_guide(HOUSE_ID, gid)
-        if not guide:
-            await cb.answer("Не найдено", show_alert=False)
-            return
-        # Use the common photo handling function
-        guide_path = f"guides/{gid}.md"
-        await send_content_with_photo(cb, db, guide_path, guide.content_md, 
-                                    InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="howto")]]),
-                                    ParseMode.MARKDOWN)
-        await cb.answer()
-        return
+async def _cb_concierge(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    # Start concierge conversation with FSM state
+    await handle_concierge_start(cb, state, config)
 
-    if data == "activities":
-        acts = [a for a in loader.list_activities(HOUSE_ID) if month_in_season(a)]
-        await cb.message.answer("Чем заняться?", reply_markup=activities_menu_kb(acts))
-        await cb.message.delete()
-        await cb.answer()
-        return
 
-    if data.startswith("activity:"):
-        aid = data.split(":", 1)[1]
-        act = loader.get_activity(HOUSE_ID, aid)
-        if not act:
-            await cb.answer("Не найдено", show_alert=False)
-            return
-        await cb.message.answer(act.to_markdown(), parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="activities")]]))
-        await cb.message.delete()
-        await cb.answer()
-        return
+async def _cb_concierge_cancel(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    await state.clear()
+    await swap_message(cb, "❌ Режим консьержа отменен.", reply_markup=MAIN_MENU_KB)
+    await cb.answer()
 
-    if data == "map":
-        md = read_markdown_cached(HOUSE_ID, "texts/map.md")
-        await send_content_with_photo(cb, db, "texts/map.md", md, back_kb())
-        await cb.answer()
-        return
 
-    if data == "feedback":
-        await cb.message.answer("Оставьте текст отзыва/сообщения. Можете прикрепить фото/видео отдельными сообщениями. В начале напишите: Разрешаю публикацию — да/нет.\n\n📷 Вы также можете прикрепить фото или видео к вашему отзыву, отправив их отдельным сообщением.", reply_markup=back_kb())
-        await cb.message.delete()
-        await cb.answer()
-        return
+async def _cb_concierge_finish(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    await state.clear()
+    await swap_message(cb, "📱 **Диалог завершен**\n\nСпасибо за обращение! Возвращайтесь, если понадобится помощь.", reply_markup=MAIN_MENU_KB)
+    await cb.answer()
 
-    if data == "specials":
-        md = read_markdown_cached(HOUSE_ID, "texts/specials.md")
-        await send_content_with_photo(cb, db, "texts/specials.md", md, back_kb())
-        await cb.answer()
+
+async def _cb_howto(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    guides = loader.list_guides(config.house_id)
+    await swap_message(cb, "Как это работает?", reply_markup=guides_menu_kb(guides))
+    await cb.answer()
+
+
+async def _cb_guide(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    guide = loader.get_guide(config.house_id, rest)
+    if not guide:
+        await cb.answer("Не найдено", show_alert=False)
         return
+    await send_content_with_photo(cb, db, config, f"guides/{rest}.md", guide.content_md,
+                                  BACK_TO_GUIDES_KB, ParseMode.MARKDOWN)
+    await cb.answer()
+
+
+async def _cb_activities(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    now = datetime.now(timezone.utc)
+    acts = [a for a in loader.list_activities(config.house_id) if month_in_season(a, now)]
+    await swap_message(cb, "Чем заняться?", reply_markup=activities_menu_kb(acts))
+    await cb.answer()
 
-    if data == "buy_house":
-        md = read_markdown_cached(HOUSE_ID, "texts/buy_house.md")
-        await send_content_with_photo(cb, db, "texts/buy_house.md", md, back_kb())
-        await cb.answer()
+
+async def _cb_activity(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    act = loader.get_activity(config.house_id, rest)
+    if not act:
+        await cb.answer("Не найдено", show_alert=False)
         return
+    await swap_message(cb, act.to_markdown(), parse_mode=None, reply_markup=BACK_TO_ACTIVITIES_KB)
+    await cb.answer()
+
+
+async def _cb_feedback(cb: CallbackQuery, state: FSMContext, db: Database, config: Config, rest: str):
+    await swap_message(cb, "Оставьте текст отзыва/сообщения. Можете прикрепить фото/видео отдельными сообщениями. В начале напишите: Разрешаю публикацию — да/нет.\n\n📷 Вы также можете прикрепить фото или видео к вашему отзыву, отправив их отдельным сообщением.", reply_markup=BACK_KB)
+    await cb.answer()
+
+
+# Buttons that just show a markdown file (with its photo, if any)
+MARKDOWN_ROUTES = {
+    "rules_house": "texts/rules_house.md",
+    "rules_inventory": "texts/rules_inventory.md",
+    "map": "texts/map.md",
+    "specials": "texts/specials.md",
+    "buy_house": "texts/buy_house.md",
+    "buy_furniture": "texts/buy_furniture.md",
+    "about": "texts/about.md",
+}
+
+
+async def _cb_markdown(cb: CallbackQuery, db: Database, config: Config, rel_path: str):
+    md = loader.read_markdown(config.house_id, rel_path)
+    await send_content_with_photo(cb, db, config, rel_path, md, BACK_KB)
+    await cb.answer()
 
-    if data == "buy_furniture":
-        md = read_markdown_cached(HOUSE_ID, "texts/buy_furniture.md")
-        await send_content_with_photo(cb, db, "texts/buy_furniture.md", md, back_kb())
-        await cb.answer()
+
+CallbackHandler = Callable[[CallbackQuery, FSMContext, Database, Config, str], Awaitable[None]]
+
+STATIC_ROUTES: Dict[str, CallbackHandler] = {
+    "admin_ls": _cb_admin_ls,
+    "back_main": _cb_back_main,
+    "concierge": _cb_concierge,
+    "concierge_cancel": _cb_concierge_cancel,
+    "concierge_finish": _cb_concierge_finish,
+    "howto": _cb_howto,
+    "activities": _cb_activities,
+    "feedback": _cb_feedback,
+}
+
+# "<prefix>:<rest>" callbacks; rest is passed to the handler
+PREFIX_ROUTES: Dict[str, CallbackHandler] = {
+    "guide": _cb_guide,
+    "activity": _cb_activity,
+    "admin_reply": _cb_admin_reply,
+}
+
+
+async def callback_router(cb: CallbackQuery, state: FSMContext, db: Database, config: Config):
+    data = cb.data or ""
+
+    handler = STATIC_ROUTES.get(data)
+    if handler:
+        await handler(cb, state, db, config, "")
         return
 
-    if data == "about":
-        md = read_markdown_cached(HOUSE_ID, "texts/about.md")
-        await send_content_with_photo(cb, db, "texts/about.md", md, back_kb())
-        await cb.answer()
+    rel_path = MARKDOWN_ROUTES.get(data)
+    if rel_path:
+        await _cb_markdown(cb, db, config, rel_path)
         return
 
+    head, sep, rest = data.partition(":")
+    handler = PREFIX_ROUTES.get(head) if sep else None
+    if handler:
+        await handler(cb, state, db, config, rest)
+
+
+# FSM state -> text handler; in waiting_for_media the user can still send text
+STATE_TEXT_HANDLERS = {
+    AuthStates.waiting_for_code.state: process_code,
+    ConciergeStates.waiting_for_message.state: handle_concierge_message,
+    ConciergeStates.waiting_for_media.state: handle_concierge_message,
+}
 
-async def text_router(message: Message, state: FSMContext, db: Database):
+
+async def text_router(message: Message, state: FSMContext, db: Database, config: Config):
     # Handle admin messages first
-    if message.from_user and is_admin(message.from_user.id):
-        logger.info(f"Processing admin message: {message.text[:50] if message.text else ''}...")
-        await admin_router(message, db)
+    if message.from_user and is_admin(message.from_user.id, config):
+        logger.debug("Processing admin message: %r", (message.text or "")[:50])
+        await admin_router(message, state, db, config)
         return
     
     # route concierge vs feedback vs code entry    
     current_state = await state.get_state()
     text = message.text or ""
-    logger.info(f"text_router: user_id={message.from_user.id}, state={current_state}, text='{text[:50]}...'")
+    logger.debug("text_router: user_id=%s state=%s text=%r", message.from_user.id, current_state, text[:50])
 
-    # If user is in waiting_for_code state, process the code
-    if current_state == AuthStates.waiting_for_code.state:
-        return await process_code(message, state, db)
-    
-    # If user is in concierge mode, handle the message appropriately
-    if current_state == ConciergeStates.waiting_for_message.state:
-        return await handle_concierge_message(message, state, db)
-    elif current_state == ConciergeStates.waiting_for_media.state:
-        # In this state, user can send additional text messages
-        return await handle_concierge_message(message, state, db)
+    # Code entry and concierge mode are routed by FSM state
+    handler = STATE_TEXT_HANDLERS.get(current_state)
+    if handler:
+        return await handler(message, state, db, config)
 
     # Check if user is authorized for normal operations
-    profile = await db.get_user(message.from_user.id)
-    now = datetime.now(timezone.utc)
-    authorized = bool(profile and profile.get("access_until") and datetime.fromisoformat(profile["access_until"]) > now)
+    authorized = await is_authorized(message.from_user.id, db)
     
-    if not authorized and AUTH_MODE == "code":
+    if not authorized and config.auth_mode == "code":
         # User is not authorized, ask for code
         await state.set_state(AuthStates.waiting_for_code)
         await message.answer("Для доступа к боту введите, пожалуйста, ваш числовой код доступа:")
         return
 
+    if not text.strip():
+        await show_main_menu(message, config)
+        return
+
     # Only forward messages that are explicitly concierge questions or feedback
     # Check if this looks like a concierge question or feedback
-    text_lower = text.lower().strip()
+    text_lower = text.casefold()
     
     # Check for explicit concierge/feedback indicators
-    is_concierge_question = any(keyword in text_lower for keyword in [
-        "вопрос", "помощь", "помогите", "как", "где", "когда", "что", "почему",
-        "консьерж", "консьержу", "администратор", "админу"
-    ])
+    is_concierge_question = CONCIERGE_KEYWORDS_RE.search(text_lower) is not None
     
-    is_feedback = "разрешаю публикацию" in text_lower or any(keyword in text_lower for keyword in [
-        "отзыв", "жалоба", "предложение", "идея", "комментарий", "мнение"
-    ])
+    is_feedback = CONSENT_RE.search(text) is not None or FEEDBACK_KEYWORDS_RE.search(text_lower) is not None
     
     # Only forward if it's clearly a concierge question or feedback
     if is_concierge_question or is_feedback:
@@ -688,195 +778,379 @@ async def text_router(message: Message, state: FSMContext, db: Database):
             payload = f"Вопрос консьержу от @{message.from_user.username or message.from_user.id}:\n{text}"
             message_type = "консьержу"
         
-        if ADMIN_IDS:
-            try:
-                # Send to all admins
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await message.bot.send_message(
-                            admin_id, payload, 
-                            parse_mode=None,  # Disable markdown parsing
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Ответить", callback_data=f"admin_reply:{message.from_user.id}")]])
-                        )
-                        logger.info(f"Successfully sent {message_type} to admin {admin_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to send message to admin {admin_id}: {e}")
-                        # Continue trying other admins
-                        
-            except Exception as e:
-                logger.exception("Failed to send admin message: %s", e)
+        if config.admin_ids:
+            # Send to all admins concurrently; failures are logged per admin
+            await broadcast_to_admins(
+                config.admin_ids,
+                lambda admin_id: message.bot.send_message(
+                    admin_id, payload,
+                    parse_mode=None,  # Disable markdown parsing
+                    reply_markup=admin_reply_kb(message.from_user.id)
+                ),
+                message_type,
+            )
         
         await message.answer(f"Спасибо! Ваше сообщение {message_type} отправлено администратору.\n\n💡 Вы также можете прикрепить фото или видео к вашему вопросу, отправив их отдельным сообщением.")
         # Вернём пользователя в главное меню
-        await show_main_menu(message)
+        await show_main_menu(message, config)
     else:
         # This is just a regular message, don't forward to admin
         # Just show the main menu
-        await show_main_menu(message)
+        await show_main_menu(message, config)
 
 
-async def media_router(message: Message):
-    # Forward photos/videos to admin
-    if ADMIN_IDS:
-        logger.info(f"Forwarding media from user {message.from_user.id} to {len(ADMIN_IDS)} admins: {ADMIN_IDS}")
+def media_too_large(message: Message, config: Config) -> bool:
+    media = message.photo[-1] if message.photo else message.video
+    return bool(media and media.file_size and media.file_size > config.max_media_bytes)
+
+
+async def forward_media(message: Message, config: Config) -> int:
+    """Copy a single photo/video to every admin; returns how many received it."""
+    logger.debug("Forwarding media from user %s to %d admins", message.from_user.id, len(config.admin_ids))
+    try:
+        # Create a safe caption without markdown conflicts
+        user_info = f"Медиа от @{message.from_user.username or message.from_user.id}"
+        if message.caption:
+            # Clean caption from any markdown that might cause parsing errors
+            clean_caption = message.caption.translate(CAPTION_SPECIALS_TABLE)
+            caption = f"{user_info}\n\n{clean_caption}"
+        else:
+            caption = user_info
+
+        admin_kb = admin_reply_kb(message.from_user.id)
+
+        def sender(text: str) -> Callable[[int], Awaitable[Any]]:
+            # copy_message clones the received photo/video server-side with our caption
+            return lambda admin_id: message.bot.copy_message(
+                admin_id, message.chat.id, message.message_id,
+                caption=text,
+                parse_mode=None,  # Disable markdown parsing to avoid conflicts
+                reply_markup=admin_kb
+            )
+
+        # Send to all admins
+        success_count = await broadcast_to_admins(config.admin_ids, sender(caption), "media")
+        if success_count == 0 and caption != user_info:
+            # The user's caption may be what Telegram rejected (e.g. too long); retry without it
+            success_count = await broadcast_to_admins(config.admin_ids, sender(user_info), "media without caption")
+        if success_count == 0:
+            logger.error(f"Failed to send media to any admin. All {len(config.admin_ids)} attempts failed.")
+        else:
+            logger.debug("Successfully sent media to %d/%d admins", success_count, len(config.admin_ids))
+        return success_count
+    except Exception as e:
+        logger.exception("Failed to forward media: %s", e)
+        return 0
+
+
+async def answer_forwarded(message: Message, success_count: int):
+    if success_count:
+        await message.answer("Принято! Передал администраторам.")
+    else:
+        await message.answer("❌ Не удалось передать администраторам. Попробуйте позже.")
+
+
+async def flush_album(group_id: str, config: Config):
+    await asyncio.sleep(ALBUM_FLUSH_DELAY)
+    ALBUM_TASKS.pop(group_id, None)
+    buffered = ALBUM_BUFFER.pop(group_id, [])
+    if not buffered:
+        return
+    first = buffered[0]
+    dropped = [i for i, m in enumerate(buffered, 1) if media_too_large(m, config)]
+    if dropped:
+        numbers = ", ".join(f"№{i}" for i in dropped)
+        await first.answer(
+            f"Файлы {numbers} из альбома больше {config.max_media_size_mb} МБ и не были отправлены. "
+            "Попробуйте файлы поменьше."
+        )
+    messages = [m for m in buffered if not media_too_large(m, config)]
+    if not messages:
+        return
+    if len(messages) == 1:
+        # send_media_group needs at least two items
+        await answer_forwarded(messages[0], await forward_media(messages[0], config))
+        return
+
+    user_info = f"Медиа от @{first.from_user.username or first.from_user.id}"
+    caption = next((m.caption for m in messages if m.caption), None)
+    if caption:
+        clean_caption = caption.translate(CAPTION_SPECIALS_TABLE)
+        caption = f"{user_info}\n\n{clean_caption}"
+    else:
+        caption = user_info
+    # Only the first item carries the caption, as Telegram shows it for the whole album
+    media = [
+        (InputMediaPhoto(media=m.photo[-1].file_id, parse_mode=None) if m.photo
+         else InputMediaVideo(media=m.video.file_id, parse_mode=None))
+        for m in messages
+    ]
+    media[0].caption = caption
+    # send_media_group takes 2-10 items; a lone trailing item rides with the previous chunk
+    chunks = [media[i:i + ALBUM_MAX_ITEMS] for i in range(0, len(media), ALBUM_MAX_ITEMS)]
+    if len(chunks) > 1 and len(chunks[-1]) == 1:
+        chunks[-1].insert(0, chunks[-2].pop())
+
+    async def send(admin_id: int):
+        for chunk in chunks:
+            await first.bot.send_media_group(admin_id, chunk)
+        # Albums can't carry inline keyboards, so the reply button follows separately.
+        # Its failure must not propagate: a retry of send() would duplicate the album.
+        await ADMIN_SEND_LIMITER.acquire(admin_id)
         try:
-            # Create a safe caption without markdown conflicts
-            user_info = f"Медиа от @{message.from_user.username or message.from_user.id}"
-            if message.caption:
-                # Clean caption from any markdown that might cause parsing errors
-                clean_caption = message.caption.replace('*', '').replace('_', '').replace('`', '').replace('[', '').replace(']', '')
-                caption = f"{user_info}\n\n{clean_caption}"
-            else:
-                caption = user_info
-            
-            # Send to all admins
-            success_count = 0
-            for admin_id in ADMIN_IDS:
-                try:
-                    if message.photo:
-                        if hasattr(message.photo[-1], 'file_size') and message.photo[-1].file_size and message.photo[-1].file_size > MAX_MEDIA_SIZE_MB * 1024 * 1024:
-                            logger.warning("Photo too large, skipping forwarding")
-                            continue
-                        await message.bot.send_photo(
-                            admin_id, message.photo[-1].file_id,
-                            caption=caption,
-                            parse_mode=None,  # Disable markdown parsing to avoid conflicts
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Ответить", callback_data=f"admin_reply:{message.from_user.id}")]])
-                        )
-                    elif message.video:
-                        if hasattr(message.video, 'file_size') and message.video.file_size and message.video.file_size > MAX_MEDIA_SIZE_MB * 1024 * 1024:
-                            logger.warning("Video too large, skipping forwarding")
-                            continue
-                        await message.bot.send_video(
-                            admin_id, message.video.file_id,
-                            caption=caption,
-                            parse_mode=None,  # Disable markdown parsing to avoid conflicts
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Ответить", callback_data=f"admin_reply:{message.from_user.id}")]])
-                        )
-                    success_count += 1
-                    logger.info(f"Successfully sent media to admin {admin_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send media to admin {admin_id}: {e}")
-                    # Continue trying other admins
-                    
-            if success_count == 0:
-                logger.error(f"Failed to send media to any admin. All {len(ADMIN_IDS)} attempts failed.")
-            else:
-                logger.info(f"Successfully sent media to {success_count}/{len(ADMIN_IDS)} admins")
-                    
+            await send_with_retry(lambda: first.bot.send_message(
+                admin_id, f"⬆️ Альбом ({len(media)} шт.) от @{first.from_user.username or first.from_user.id}",
+                parse_mode=None,
+                reply_markup=admin_reply_kb(first.from_user.id),
+            ))
         except Exception as e:
-            logger.exception("Failed to forward media: %s", e)
-            # Try to send without caption if there's still an error
-            try:
-                success_count = 0
-                for admin_id in ADMIN_IDS:
-                    try:
-                        if message.photo:
-                            await message.bot.send_photo(
-                                admin_id, message.photo[-1].file_id,
-                                caption=f"Медиа от @{message.from_user.username or message.from_user.id}",
-                                parse_mode=None,
-                                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Ответить", callback_data=f"admin_reply:{message.from_user.id}")]])
-                            )
-                        elif message.video:
-                            await message.bot.send_video(
-                                admin_id, message.video.file_id,
-                                caption=f"Видео от @{message.from_user.username or message.from_user.id}",
-                                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Ответить", callback_data=f"admin_reply:{message.from_user.id}")]])
-                            )
-                        success_count += 1
-                    except Exception as e2:
-                        logger.error(f"Failed to send media to admin {admin_id} even without caption: {e2}")
-                if success_count == 0:
-                    logger.error(f"Failed to send media to any admin even without caption")
-            except Exception as e2:
-                logger.exception("Failed to forward media even without caption: {e2}")
-    else:
+            logger.error(f"Failed to send album reply button to admin {admin_id}: {e}")
+
+    try:
+        success_count = await broadcast_to_admins(config.admin_ids, send, f"album of {len(media)}")
+    except Exception as e:
+        logger.exception("Failed to forward album %s: %s", group_id, e)
+        success_count = 0
+    await answer_forwarded(first, success_count)
+
+
+async def media_router(message: Message, config: Config):
+    if message.media_group_id and config.admin_ids:
+        group_id = message.media_group_id
+        ALBUM_BUFFER.setdefault(group_id, []).append(message)
+        # Restart the quiet-period timer on every new item
+        pending = ALBUM_TASKS.pop(group_id, None)
+        if pending:
+            pending.cancel()
+        ALBUM_TASKS[group_id] = asyncio.create_task(flush_album(group_id, config))
+        return
+
+    if media_too_large(message, config):
+        await message.answer(f"Файл слишком большой (больше {config.max_media_size_mb} МБ) и не был отправлен. Попробуйте файл поменьше.")
+        return
+
+    # Forward photos/videos to admin
+    if not config.admin_ids:
         logger.warning("No admin IDs configured, cannot forward media")
-    
-    await message.answer("Принято! Передал администраторам.")
+    await answer_forwarded(message, await forward_media(message, config) if config.admin_ids else 0)
 
 
-async def check_admin_config():
+async def check_admin_config(bot: Bot, config: Config):
     """Check admin configuration and log issues"""
     logger.info(f"Admin configuration check:")
-    logger.info(f"  ADMIN_IDS_STR: '{ADMIN_IDS_STR}'")
-    logger.info(f"  Parsed ADMIN_IDS: {ADMIN_IDS}")
-    logger.info(f"  ADMIN_CHAT_ID (backward compat): {ADMIN_CHAT_ID}")
+    logger.info(f"  Parsed ADMIN_IDS: {sorted(config.admin_ids)}")
+    logger.info(f"  ADMIN_CHAT_ID (backward compat): {config.admin_chat_id}")
     
-    if not ADMIN_IDS:
+    if not config.admin_ids:
         logger.error("No admin IDs configured! Bot will not be able to forward messages to admins.")
         logger.error("Please set ADMIN_IDS in your .env file (e.g., ADMIN_IDS=123456789,987654321)")
         return False
     
-    # Test if we can send a test message to each admin
+    # Check every admin chat concurrently over the main bot's session
     logger.info("Testing admin message delivery...")
-    from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
-    
-    for admin_id in ADMIN_IDS:
+
+    async def check_one(admin_id: int):
         try:
-            # Create a temporary bot instance to test message sending
-            test_bot = Bot(BOT_TOKEN)
-            try:
-                # Try to get chat info to verify the admin ID is valid
-                chat = await test_bot.get_chat(admin_id)
-                logger.info(f"✅ Admin {admin_id} is accessible: {chat.type} - {getattr(chat, 'title', getattr(chat, 'username', 'Unknown'))}")
-            except TelegramBadRequest as e:
-                if "chat not found" in str(e).lower():
-                    logger.error(f"❌ Admin {admin_id}: Chat not found - this ID may be invalid or the bot hasn't been started by this user")
-                elif "bot was blocked" in str(e).lower():
-                    logger.error(f"❌ Admin {admin_id}: Bot was blocked by this user")
-                else:
-                    logger.error(f"❌ Admin {admin_id}: Bad request - {e}")
-            except TelegramForbiddenError as e:
-                logger.error(f"❌ Admin {admin_id}: Forbidden - {e}")
-            except Exception as e:
-                logger.error(f"❌ Admin {admin_id}: Unexpected error - {e}")
-            finally:
-                await test_bot.session.close()
+            # Try to get chat info to verify the admin ID is valid
+            chat = await bot.get_chat(admin_id)
+            logger.info(f"✅ Admin {admin_id} is accessible: {chat.type} - {getattr(chat, 'title', getattr(chat, 'username', 'Unknown'))}")
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                logger.error(f"❌ Admin {admin_id}: Chat not found - this ID may be invalid or the bot hasn't been started by this user")
+            elif "bot was blocked" in str(e).lower():
+                logger.error(f"❌ Admin {admin_id}: Bot was blocked by this user")
+            else:
+                logger.error(f"❌ Admin {admin_id}: Bad request - {e}")
+        except TelegramForbiddenError as e:
+            logger.error(f"❌ Admin {admin_id}: Forbidden - {e}")
         except Exception as e:
-            logger.error(f"❌ Failed to test admin {admin_id}: {e}")
+            logger.error(f"❌ Admin {admin_id}: Unexpected error - {e}")
+
+    await asyncio.gather(*(check_one(admin_id) for admin_id in config.admin_ids))
     
     return True
 
 
-async def on_startup(bot: Bot, db: Database):
-    logger.info("Bot started for house %s", HOUSE_ID)
+async def on_startup(bot: Bot, db: Database, config: Config):
+    logger.info("Bot started for house %s", config.house_id)
     await ensure_db(db)
-    
+    PHOTO_FILE_IDS.update(await db.photo_file_ids())
+    # Read content once up front (in a worker thread) so the first button presses don't hit the disk
+    n = await asyncio.to_thread(loader.preload, config.house_id)
+    logger.info("Preloaded %d text files for house %s", n, config.house_id)
+
     # Check admin configuration
-    await check_admin_config()
+    await check_admin_config(bot, config)
 
 
-# Admin: simple content management and reply routing
-async def admin_router(message: Message, db: Database):
-    user = message.from_user
-    if not user or not is_admin(user.id):
-        logger.info(f"admin_router: not admin user_id={user.id if user else None}")
-        return False  # Continue to other handlers
+async def on_shutdown(db: Database):
+    await db.close()
+    logger.info("Database closed")
 
-    txt = (message.text or "").strip()
 
-    # If admin is replying to a user (pending target)
-    target = ADMIN_REPLY_TARGET.get(user.id)
-    if target:
+# Blocking file helpers for the admin commands; called via asyncio.to_thread
+def read_text_head(path: Path, limit: int) -> Optional[str]:
+    """First ``limit`` characters of the file, or None if it doesn't exist."""
+    try:
+        with path.open(encoding="utf-8") as f:
+            return f.read(limit)
+    except FileNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=1)
+def current_umask() -> int:
+    """The process umask; it can only be read by setting it, so this is done once."""
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+def write_text_file(path: Path, text: str):
+    """Atomic replace: readers see the old file or the new one, never a truncated one."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per write, so concurrent edits of one file don't share a temp file;
+    # dot-prefixed, so the content walk skips it
+    f = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent,
+                                    prefix=f".{path.name}.", suffix=".tmp", delete=False)
+    tmp = f.name
+    try:
+        with f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # Temp files are 0600: keep the old file's mode, or give a new file the usual umask default
+        try:
+            mode = path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~current_umask()
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+
+
+def delete_photo_files(directory: Path, stem: str) -> List[Path]:
+    """Remove directory/<stem>.* (any extension); returns the paths deleted."""
+    deleted = []
+    for photo_path in directory.glob(f"{stem}.*"):
         try:
-            if message.text:
-                await message.bot.send_message(target, f"Вам пришло сообщение от консьержа!\n\n{message.text}")
-            elif message.photo:
-                caption = f"Вам пришло сообщение от консьержа!\n\n{message.caption or ''}"
-                await message.bot.send_photo(target, message.photo[-1].file_id, caption=caption)
-            elif message.video:
-                caption = f"Вам пришло сообщение от консьержа!\n\n{message.caption or ''}"
-                await message.bot.send_video(target, message.video.file_id, caption=caption)
-            await message.answer(f"Отправлено пользователю {target}")
-        finally:
-            ADMIN_REPLY_TARGET.pop(user.id, None)
+            photo_path.unlink()
+            deleted.append(photo_path)
+        except OSError as e:
+            logger.error(f"Failed to delete photo file {photo_path}: {e}")
+    return deleted
+
+
+# Admin FSM modes: registered with state filters, so aiogram routes straight here
+async def admin_reply_message(message: Message, state: FSMContext):
+    """AdminStates.replying: deliver this admin message to the user picked with the reply button."""
+    target = (await state.get_data()).get("target")
+    try:
+        await ADMIN_SEND_LIMITER.acquire(target)
+        if message.text:
+            await send_with_retry(lambda: message.bot.send_message(target, f"Вам пришло сообщение от консьержа!\n\n{message.text}"))
+        elif message.photo:
+            caption = f"Вам пришло сообщение от консьержа!\n\n{message.caption or ''}"
+            await send_with_retry(lambda: message.bot.send_photo(target, message.photo[-1].file_id, caption=caption))
+        elif message.video:
+            caption = f"Вам пришло сообщение от консьержа!\n\n{message.caption or ''}"
+            await send_with_retry(lambda: message.bot.send_video(target, message.video.file_id, caption=caption))
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        # Permanent (chat not found, bot blocked): resending won't help
+        await state.clear()
+        logger.error(f"Failed to deliver admin reply to {target}: {e}")
+        await message.answer(f"Не удалось доставить сообщение пользователю {target}: {e}", parse_mode=None)
+        return
+    except Exception as e:
+        # Transient and retries ran out: stay in reply mode so the admin can just resend
+        logger.error(f"Failed to deliver admin reply to {target}: {e}")
+        await message.answer(
+            f"Не удалось отправить сообщение пользователю {target}, попробуйте ещё раз. "
+            f"Режим ответа сохранён, /menu — выйти.",
+            parse_mode=None,
+        )
         return
+    await state.clear()
+    await message.answer(f"Отправлено пользователю {target}")
 
-    # Admin commands
-    if txt == "/admin" or txt == "/admin_menu":
-        help_text = """🔧 **Админ-панель для дома {house_id}**
+
+async def admin_save_photo(message: Message, state: FSMContext, db: Database, config: Config):
+    """AdminStates.uploading_photo: acknowledge at once, then download and attach the photo
+    to data["content_path"] in the background; the acknowledgement is edited with the result."""
+    content_path = (await state.get_data())["content_path"]
+    # Leave upload mode before the slow part: a second photo can't start a racing save,
+    # and the task never has to clear a mode the admin entered in the meantime
+    await state.clear()
+    ack = await message.answer("⏳ Сохраняю фото…", parse_mode=None)
+    task = asyncio.create_task(save_photo(message, state, db, photos_dir(config), content_path, ack))
+    PHOTO_SAVE_TASKS.add(task)
+    task.add_done_callback(PHOTO_SAVE_TASKS.discard)
+
+
+async def save_photo(message: Message, state: FSMContext, db: Database, directory: Path, content_path: str, ack: Message):
+    photo = message.photo[-1]  # Get highest resolution
+
+    try:
+        # Download the photo
+        file_info = await message.bot.get_file(photo.file_id)
+        file_extension = file_info.file_path.split('.')[-1] if file_info.file_path else 'jpg'
+
+        # Generate filename based on content path
+        safe_name = content_path.replace('/', '_').replace('\\', '_')
+        photo_filename = f"{safe_name}.{file_extension}"
+
+        # Create photos directory
+        await asyncio.to_thread(directory.mkdir, exist_ok=True)
+
+        # Download and save photo (aiogram writes it through aiofiles)
+        photo_path = directory / photo_filename
+        await message.bot.download_file(file_info.file_path, photo_path)
+
+        # Save to database; the admin's upload already has a file_id users can be sent
+        await db.add_photo(content_path, photo_filename, photo.file_id)
+        PHOTO_FILE_IDS[normalize_content_path(content_path)] = photo.file_id
+    except Exception as e:
+        logger.exception(f"Failed to save photo for {content_path}: {e}")
+        await _restore_photo_upload(state, content_path)
+        result = (
+            f"❌ **Ошибка при сохранении фото**\n\n"
+            f"📁 Контент: {content_path}\n"
+            f"🔧 Попробуйте еще раз или обратитесь к разработчику.\n"
+            f"Ошибка: {str(e)}"
+        )
+    else:
+        logger.info(f"Photo saved for {content_path}: {photo_filename}")
+        result = (
+            f"✅ **Фото успешно добавлено!**\n\n"
+            f"📁 Контент: {content_path}\n"
+            f"📷 Файл: {photo_filename}\n"
+            f"📊 Размер: {photo.file_size if photo.file_size else 'неизвестно'} байт\n"
+            f"🎯 Фото будет показываться пользователям при просмотре этого контента!"
+        )
+
+    # Nobody awaits this task, so a failed edit (ack deleted, network) is only logged
+    try:
+        await ack.edit_text(result, parse_mode=None)
+    except Exception as e:
+        logger.error(f"Failed to report photo save result for {content_path}: {e}")
+
+
+async def _restore_photo_upload(state: FSMContext, content_path: str):
+    """Put the admin back into upload mode for content_path so the photo can simply be resent,
+    unless they have already moved on to another mode."""
+    try:
+        if await state.get_state() is None:
+            await state.set_state(AdminStates.uploading_photo)
+            await state.set_data({"content_path": content_path})
+    except Exception as e:
+        logger.error(f"Failed to restore photo upload mode for {content_path}: {e}")
+
+
+# Admin: simple content management and reply routing
+ADMIN_HELP_TEXT = """🔧 **Админ-панель для дома {house_id}**
 
 📁 **/ls** - Показать все файлы контента
 Пример: просто напишите `/ls`
@@ -900,107 +1174,112 @@ async def admin_router(message: Message, db: Database):
 • `texts/rules_house.md` - Правила дома
 • `guides/sauna.md` - Гид по бане
 • `activities.yaml` - Список активностей
+  (если есть `activities.json`, бот читает его — тогда правьте `/put activities.json`)
 
-📊 **Статистика:** Коды работают многоразово ✅""".format(house_id=HOUSE_ID)
-        
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📁 Список файлов", callback_data="admin_ls")],
-        ])
-        await message.answer(help_text, parse_mode=None, reply_markup=kb)
-        return
+📊 **Статистика:** Коды работают многоразово ✅"""
 
-    if txt.startswith("/put "):
-        rel_path = txt.split(" ", 1)[1].strip()
-        ADMIN_EDIT_PENDING[user.id] = rel_path
-        
-        # Check if file exists to give better feedback
-        base = loader._house_dir(HOUSE_ID)
-        target_file = base / rel_path
-        
-        if target_file.exists():
-            current_content = target_file.read_text(encoding='utf-8')
-            preview = current_content[:300] + ('...' if len(current_content) > 300 else '')
-            status = f"⚙️ Редактирование файла: {rel_path}\n\n📄 Текущий контент:\n{preview}\n\n📝 Отправьте новый текст (одним сообщением):"
-        else:
-            status = f"➕ Создание нового файла: {rel_path}\n\n📝 Отправьте содержимое (одним сообщением):"
-            
-        await message.answer(status, parse_mode=None)
-        return
 
-    if txt == "/ls":
-        # list common files
-        base = loader._house_dir(HOUSE_ID)
-        files = []
-        for sub in [base / "texts", base / "guides"]:
-            if sub.exists():
-                for p in sorted(sub.glob("**/*")):
-                    if p.is_file():
-                        files.append(str(p.relative_to(base)))
-        if (base / "activities.yaml").exists():
-            files.append("activities.yaml")
-        
-        if files:
-            listing = "\n".join(f"📄 {f}" for f in files)
-            response = f"📁 **Файлы контента (дом {HOUSE_ID}):**\n\n{listing}\n\nℹ️ Для редактирования используйте:\n`/put <путь>`"
-        else:
-            response = f"⚠️ Нет файлов в доме {HOUSE_ID}"
-        
-        await message.answer(response, parse_mode=None)
-        return
+async def _admin_help(message: Message, state: FSMContext, db: Database, config: Config, arg: str):
+    await message.answer(ADMIN_HELP_TEXT.format(house_id=config.house_id), parse_mode=None, reply_markup=ADMIN_PANEL_KB)
+
+
+async def _admin_put(message: Message, state: FSMContext, db: Database, config: Config, rel_path: str):
+    await state.set_state(AdminStates.editing)
+    await state.set_data({"rel_path": rel_path})
+
+    # Check if file exists to give better feedback
+    target_file = loader._house_dir(config.house_id) / rel_path
+
+    # One character past the preview tells whether it was cut
+    current_content = await asyncio.to_thread(read_text_head, target_file, 301)
+    if current_content is not None:
+        preview = current_content[:300] + ('...' if len(current_content) > 300 else '')
+        status = f"⚙️ Редактирование файла: {rel_path}\n\n📄 Текущий контент:\n{preview}\n\n📝 Отправьте новый текст (одним сообщением):"
+    else:
+        status = f"➕ Создание нового файла: {rel_path}\n\n📝 Отправьте содержимое (одним сообщением):"
+    if rel_path == "activities.yaml" and await asyncio.to_thread(target_file.with_name("activities.json").exists):
+        # The loader prefers activities.json, so this edit would not show up
+        status = ("⚠️ В доме есть activities.json — бот показывает его, а не activities.yaml. "
+                  f"Чтобы изменить список, используйте /put activities.json.\n\n{status}")
 
-    if txt.startswith("/photo "):
-        content_path = txt.split(" ", 1)[1].strip()
-        ADMIN_PHOTO_PENDING[user.id] = content_path
+    await message.answer(status, parse_mode=None)
+
+
+async def _admin_ls(message: Message, state: FSMContext, db: Database, config: Config, arg: str):
+    await message.answer(await content_listing(config.house_id, "command", _render_command_listing), parse_mode=None)
+
+
+async def _admin_photo(message: Message, state: FSMContext, db: Database, config: Config, content_path: str):
+    await state.set_state(AdminStates.uploading_photo)
+    await state.set_data({"content_path": content_path})
+    await message.answer(
+        f"📷 Добавление фото для: {content_path}\n\n"
+        f"📤 Отправьте фотографию следующим сообщением.\n"
+        f"💡 Если фото уже существует, оно будет заменено.",
+        parse_mode=None
+    )
+
+
+async def _admin_delpic(message: Message, state: FSMContext, db: Database, config: Config, content_path: str):
+    photo_file = await db.delete_photo(content_path)
+    PHOTO_FILE_IDS.pop(normalize_content_path(content_path), None)
+    if photo_file:
+        # Also delete the physical file, plus copies left by earlier uploads with another extension
+        for photo_path in await asyncio.to_thread(delete_photo_files, photos_dir(config), Path(photo_file).stem):
+            logger.info(f"Deleted photo file: {photo_path}")
         await message.answer(
-            f"📷 Добавление фото для: {content_path}\n\n"
-            f"📤 Отправьте фотографию следующим сообщением.\n"
-            f"💡 Если фото уже существует, оно будет заменено.",
+            f"✅ **Фото удалено!**\n\n"
+            f"📁 Контент: {content_path}\n"
+            f"🗑️ Фото больше не привязано к этому контенту.",
+            parse_mode=None
+        )
+    else:
+        await message.answer(
+            f"⚠️ **Фото не найдено**\n\n"
+            f"📁 Контент: {content_path}\n"
+            f"🔍 К этому контенту не привязано фото.",
             parse_mode=None
         )
-        return
 
-    if txt.startswith("/delpic "):
-        content_path = txt.split(" ", 1)[1].strip()
-        deleted = await db.delete_photo(content_path)
-        if deleted:
-            # Also delete the physical file if exists
-            photos_dir = loader._house_dir(HOUSE_ID) / "photos"
-            photo_file = await db.get_photo(content_path)  # This will return None now since we deleted it
-            # Try to find and delete the old photo file
-            for photo_path in photos_dir.glob(f"{content_path.replace('/', '_')}.*"):
-                try:
-                    photo_path.unlink()
-                    logger.info(f"Deleted photo file: {photo_path}")
-                except Exception as e:
-                    logger.error(f"Failed to delete photo file {photo_path}: {e}")
-            await message.answer(
-                f"✅ **Фото удалено!**\n\n"
-                f"📁 Контент: {content_path}\n"
-                f"🗑️ Фото больше не привязано к этому контенту.",
-                parse_mode=None
-            )
-        else:
-            await message.answer(
-                f"⚠️ **Фото не найдено**\n\n"
-                f"📁 Контент: {content_path}\n"
-                f"🔍 К этому контенту не привязано фото.",
-                parse_mode=None
-            )
-        return
+
+AdminCommand = Callable[[Message, FSMContext, Database, Config, str], Awaitable[None]]
+
+# command -> (handler, takes an argument); "/put" without a path is not a command
+ADMIN_COMMANDS: Dict[str, Tuple[AdminCommand, bool]] = {
+    "/admin": (_admin_help, False),
+    "/admin_menu": (_admin_help, False),
+    "/ls": (_admin_ls, False),
+    "/put": (_admin_put, True),
+    "/photo": (_admin_photo, True),
+    "/delpic": (_admin_delpic, True),
+}
+
+
+# Admin: simple content management and reply routing
+async def admin_router(message: Message, state: FSMContext, db: Database, config: Config):
+    """Text from an admin; text_router has already checked is_admin."""
+    # Admin commands
+    parts = (message.text or "").split(maxsplit=1)
+    if parts:
+        command = ADMIN_COMMANDS.get(parts[0])
+        arg = parts[1].strip() if len(parts) > 1 else ""
+        if command and command[1] == bool(arg):
+            await command[0](message, state, db, config, arg)
+            return
+
+    current_state = await state.get_state()
 
     # If pending edit path and admin sends text
-    pending = ADMIN_EDIT_PENDING.get(user.id)
-    if pending and message.text:
-        rel = pending
+    if current_state == AdminStates.editing.state and message.text:
+        rel = (await state.get_data())["rel_path"]
         # secure write
-        base = loader._house_dir(HOUSE_ID)
-        target = (base / rel).resolve()
-        if base.resolve() not in target.parents and base.resolve() != target:
+        house_dir = resolved_house_dir(config.house_id)
+        target = (house_dir / rel).resolve()
+        if not target.is_relative_to(house_dir):
             await message.answer("Некорректный путь")
             return
-        target.parent.mkdir(parents=True, exist_ok=True)
-        target.write_text(message.text, encoding="utf-8")
-        ADMIN_EDIT_PENDING.pop(user.id, None)
+        await asyncio.to_thread(write_text_file, target, message.text)
+        await state.clear()
         
         # Get file size for feedback
         file_size = len(message.text.encode('utf-8'))
@@ -1013,106 +1292,86 @@ async def admin_router(message: Message, db: Database):
         )
         return
 
-    # If pending photo and admin sends photo
-    if message.photo and user.id in ADMIN_PHOTO_PENDING:
-        content_path = ADMIN_PHOTO_PENDING[user.id]
-        photo = message.photo[-1]  # Get highest resolution
-        
-        try:
-            # Download the photo
-            file_info = await message.bot.get_file(photo.file_id)
-            file_extension = file_info.file_path.split('.')[-1] if file_info.file_path else 'jpg'
-            
-            # Generate filename based on content path
-            safe_name = content_path.replace('/', '_').replace('\\', '_')
-            photo_filename = f"{safe_name}.{file_extension}"
-            
-            # Create photos directory
-            photos_dir = loader._house_dir(HOUSE_ID) / "photos"
-            photos_dir.mkdir(exist_ok=True)
-            
-            # Download and save photo
-            photo_path = photos_dir / photo_filename
-            await message.bot.download_file(file_info.file_path, photo_path)
-            
-            # Save to database
-            await db.add_photo(content_path, photo_filename)
-            
-            # Clean up pending state
-            ADMIN_PHOTO_PENDING.pop(user.id, None)
-            
-            await message.answer(
-                f"✅ **Фото успешно добавлено!**\n\n"
-                f"📁 Контент: {content_path}\n"
-                f"📷 Файл: {photo_filename}\n"
-                f"📊 Размер: {photo.file_size if photo.file_size else 'неизвестно'} байт\n"
-                f"🎯 Фото будет показываться пользователям при просмотре этого контента!",
-                parse_mode=None
-            )
-            logger.info(f"Photo saved for {content_path}: {photo_filename}")
-            
-        except Exception as e:
-            logger.exception(f"Failed to save photo for {content_path}: {e}")
-            await message.answer(
-                f"❌ **Ошибка при сохранении фото**\n\n"
-                f"📁 Контент: {content_path}\n"
-                f"🔧 Попробуйте еще раз или обратитесь к разработчику.\n"
-                f"Ошибка: {str(e)}",
-                parse_mode=None
-            )
-        return
-
 
 async def main():
-    if not BOT_TOKEN:
+    # Settings are read here, not at import, so importing the module has no side effects
+    config = Config.from_env()
+    if not config.bot_token:
         logger.critical("BOT_TOKEN is missing. Exiting.")
         sys.exit(1)
-    bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-    dp = Dispatcher(storage=MemoryStorage())
-    db = Database(DB_PATH)
+    bot = Bot(config.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+    dp = Dispatcher(storage=make_storage(timedelta(minutes=config.state_ttl_minutes), config.redis_url))
+    db = Database(config.db_path)
 
-    # Wrapper handlers that close over db and pass state correctly
+    # Wrapper handlers that close over db and config and pass state correctly
     async def on_start(message: Message, state: FSMContext):
-        await start_handler(message, state, db)
+        await start_handler(message, state, db, config)
 
     async def on_menu(message: Message, state: FSMContext):
-        await start_handler(message, state, db)
+        await start_handler(message, state, db, config)
 
     async def on_callback(cb: CallbackQuery, state: FSMContext):
-        await callback_router(cb, state, db)
+        await callback_router(cb, state, db, config)
 
     async def on_text(message: Message, state: FSMContext):
-        await text_router(message, state, db)
+        await text_router(message, state, db, config)
 
     # Register handlers in correct order
+    async def on_admin_photo(message: Message, state: FSMContext):
+        await admin_save_photo(message, state, db, config)
+
+    async def on_concierge_media(message: Message, state: FSMContext):
+        await handle_concierge_media(message, state, config)
+
+    async def on_media(message: Message):
+        await media_router(message, config)
+
     dp.message.register(on_start, CommandStart())
     dp.message.register(on_menu, Command("menu"))
     dp.callback_query.register(on_callback)
+
+    # Admin modes take priority over the generic text/media routers
+    from_admin = F.from_user.id.in_(config.admin_ids)
+    dp.message.register(admin_reply_message, AdminStates.replying, from_admin, F.text | F.photo | F.video)
+    dp.message.register(on_admin_photo, AdminStates.uploading_photo, from_admin, F.photo)
     
     dp.message.register(on_text, F.text)
     
-    async def on_media(message: Message, state: FSMContext):
-        # Check if admin is uploading photo for content
-        if message.from_user and is_admin(message.from_user.id) and message.photo:
-            await admin_router(message, db)
-        else:
-            # Check if user is in concierge mode
-            current_state = await state.get_state()
-            if current_state in [ConciergeStates.waiting_for_message.state, ConciergeStates.waiting_for_media.state]:
-                await handle_concierge_media(message, state)
-            else:
-                await media_router(message)
-    
+    async def ignore_admin_photo(message: Message):
+        pass
+
+    # Media: admin photos only matter while uploading (handled by on_admin_photo), then
+    # concierge mode, then plain forwarding; the filters pick the handler, no get_state() here
+    dp.message.register(ignore_admin_photo, from_admin, F.photo)
+    dp.message.register(on_concierge_media, StateFilter(ConciergeStates), F.photo | F.video)
     dp.message.register(on_media, F.photo | F.video)
 
-    await on_startup(bot, db)
+    # aiogram passes workflow data to shutdown hooks by parameter name; it closes dp.storage itself
+    dp["db"] = db
+    dp.shutdown.register(on_shutdown)
+
+    await on_startup(bot, db, config)
 
     await dp.start_polling(bot)
 
 
+def run(coro: Awaitable[Any]) -> Any:
+    """asyncio.run on uvloop's faster event loop when it is installed (not available on Windows)."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(coro)
+    logger.info("Using uvloop event loop")
+    if sys.version_info >= (3, 12):
+        return asyncio.run(coro, loop_factory=uvloop.new_event_loop)
+    # Older Pythons have no loop_factory; the policy is deprecated from 3.12 on
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped")
 
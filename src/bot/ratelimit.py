@@ -0,0 +1,82 @@
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger("house-bots")
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """``capacity`` tokens refilled at ``rate`` per second.
+
+    ``reserve`` always takes a token and returns how long the caller has to
+    wait for it, so concurrent callers queue up instead of racing."""
+
+    __slots__ = ("capacity", "rate", "tokens", "last")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class SendLimiter:
+    """Bot-wide and per-chat budgets for outgoing messages (Telegram answers 429 beyond them)."""
+
+    def __init__(self, global_per_second: float = 30, per_chat_per_minute: float = 20):
+        self._global = TokenBucket(global_per_second, global_per_second)
+        self._per_chat_per_minute = per_chat_per_minute
+        self._chats: Dict[int, TokenBucket] = {}
+        self._next_sweep = time.monotonic() + 60
+
+    def _sweep(self, now: float):
+        # Only a bucket that has refilled completely is the same as a fresh one; one still
+        # paying off a burst deficit must stay, or the next burst would skip the per-chat cap
+        for chat_id, bucket in list(self._chats.items()):
+            if bucket.tokens + (now - bucket.last) * bucket.rate >= bucket.capacity:
+                del self._chats[chat_id]
+        self._next_sweep = now + 60
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._per_chat_per_minute, self._per_chat_per_minute / 60)
+        delay = max(self._global.reserve(), bucket.reserve())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def send_with_retry(call: Callable[[], Awaitable[T]], attempts: int = 3,
+                          base: float = 0.4, cap: float = 30.0) -> T:
+    """Run ``call()``, retrying flood control (429, after its retry_after) and
+    network/5xx errors (exponential backoff with jitter). Other errors such as
+    "chat not found" or "bot was blocked" are permanent and raised at once."""
+    for attempt in range(attempts - 1):
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            delay = min(cap, e.retry_after)
+            reason = "flood control"
+        except (TelegramNetworkError, TelegramServerError) as e:
+            delay = min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+            reason = type(e).__name__
+        logger.warning("Telegram send failed (%s), retrying in %.1fs", reason, delay)
+        await asyncio.sleep(delay)
+    return await call()  # last attempt: errors propagate
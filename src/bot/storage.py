@@ -0,0 +1,104 @@
+from __future__ import annotations
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+class TTLMemoryStorage(MemoryStorage):
+    """MemoryStorage that forgets records idle for longer than ``ttl``.
+
+    The stock storage is a defaultdict, so even reading the state of a user
+    who never had one leaves an empty record behind forever."""
+
+    def __init__(self, ttl: timedelta):
+        super().__init__()
+        self.ttl = ttl.total_seconds()
+        self._touched: Dict[StorageKey, float] = {}
+        self._next_sweep = time.monotonic() + self.ttl
+
+    def _touch(self, key: StorageKey):
+        now = time.monotonic()
+        record = self.storage.get(key)
+        if record is not None and record.state is None and not record.data:
+            # Cleared state: nothing worth keeping
+            del self.storage[key]
+            self._touched.pop(key, None)
+        elif record is not None:
+            self._touched[key] = now
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+    def _sweep(self, now: float):
+        deadline = now - self.ttl
+        for key, ts in list(self._touched.items()):
+            if ts < deadline:
+                del self._touched[key]
+                self.storage.pop(key, None)
+        self._next_sweep = now + self.ttl
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await super().set_state(key, state)
+        self._touch(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self.storage.get(key)
+        if record is None:
+            return None
+        self._touch(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await super().set_data(key, data)
+        self._touch(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self.storage.get(key)
+        if record is None:
+            return {}
+        self._touch(key)
+        return record.data.copy()
+
+
+def _sliding_redis_storage() -> type:
+    """RedisStorage whose reads also push the key's expiry back, so records expire
+    after ``ttl`` of inactivity like TTLMemoryStorage, not ``ttl`` after the last write.
+    GETEX (Redis 6.2+) reads and re-arms the TTL in the same round trip."""
+    # Imported lazily: the redis package is only needed for this setup
+    from aiogram.fsm.storage.redis import RedisStorage
+
+    class SlidingRedisStorage(RedisStorage):
+        async def get_state(self, key: StorageKey) -> Optional[str]:
+            value = await self.redis.getex(self.key_builder.build(key, "state"), ex=self.state_ttl)
+            if isinstance(value, bytes):
+                return value.decode("utf-8")
+            return value
+
+        async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+            value = await self.redis.getex(self.key_builder.build(key, "data"), ex=self.data_ttl)
+            if value is None:
+                return {}
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            return self.json_loads(value)
+
+    return SlidingRedisStorage
+
+
+def make_storage(ttl: timedelta, redis_url: str = "") -> BaseStorage:
+    """FSM storage: Redis when ``redis_url`` is set (dialogue state survives restarts),
+    otherwise the in-process TTLMemoryStorage. Either way a record is dropped after
+    ``ttl`` without reads or writes."""
+    if not redis_url:
+        return TTLMemoryStorage(ttl=ttl)
+    storage_cls = _sliding_redis_storage()
+    try:
+        import orjson
+    except ImportError:  # optional speedup; aiogram falls back to stdlib json
+        return storage_cls.from_url(redis_url, state_ttl=ttl, data_ttl=ttl)
+    return storage_cls.from_url(
+        redis_url, state_ttl=ttl, data_ttl=ttl,
+        json_loads=orjson.loads, json_dumps=lambda obj: orjson.dumps(obj).decode(),
+    )